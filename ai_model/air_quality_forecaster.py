@@ -1,108 +1,312 @@
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-import tensorflow as tf
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense, Dropout
-import joblib
 import json
-from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
 import warnings
+from metrics import registry, time_stage
+from model_bundle import BUNDLE_FILENAME, DIRECT_BUNDLE_FILENAME, FlatEnsemble, read_bundle, write_bundle
+from training_data import DEFAULT_CHUNK_SIZE
 warnings.filterwarnings('ignore')
 
+# pandas, scikit-learn and joblib are imported where they are used, so a
+# serving process that only loads models and predicts starts quickly
+DEFAULT_MODEL_DIR = os.environ.get('MODEL_DIR', 'models')
+
+# Versions save_model_version keeps in the model directory, newest first (0 keeps
+# every version); the one LATEST points to is never removed
+MODEL_KEEP_VERSIONS = int(os.environ.get('MODEL_KEEP_VERSIONS', 5))
+
+# Compiled (flat node array) inference beats sklearn's predict for small batches;
+# larger batches go to sklearn's estimators when they are loaded
+COMPILED_INFERENCE = os.environ.get('COMPILED_INFERENCE', '1') != '0'
+COMPILED_MAX_ROWS = int(os.environ.get('COMPILED_MAX_ROWS', 64))
+
+# Simplified AQI breakpoints (US EPA standard): (bp_low, bp_high, aqi_low, aqi_high)
+AQI_BREAKPOINTS = {
+    'pm25': [(0, 12, 0, 50), (12.1, 35.4, 51, 100), (35.5, 55.4, 101, 150), 
+             (55.5, 150.4, 151, 200), (150.5, 250.4, 201, 300), (250.5, 500, 301, 500)],
+    'pm10': [(0, 54, 0, 50), (55, 154, 51, 100), (155, 254, 101, 150), 
+             (255, 354, 151, 200), (355, 424, 201, 300), (425, 604, 301, 500)],
+    'co2': [(0, 400, 0, 50), (401, 1000, 51, 100), (1001, 2000, 101, 150), 
+            (2001, 5000, 151, 200), (5001, 10000, 201, 300), (10001, 40000, 301, 500)],
+    'no2': [(0, 53, 0, 50), (54, 100, 51, 100), (101, 360, 101, 150), 
+            (361, 649, 151, 200), (650, 1249, 201, 300), (1250, 2049, 301, 500)],
+    'so2': [(0, 35, 0, 50), (36, 75, 51, 100), (76, 185, 101, 150), 
+            (186, 304, 151, 200), (305, 604, 201, 300), (605, 1004, 301, 500)],
+    'o3': [(0, 54, 0, 50), (55, 70, 51, 100), (71, 85, 101, 150), 
+           (86, 105, 151, 200), (106, 200, 201, 300), (201, 400, 301, 500)]
+}
+
+# Precomputed (pollutants x bands x 4) lookup table for vectorized AQI
+AQI_TABLE_INDEX = {pollutant: i for i, pollutant in enumerate(AQI_BREAKPOINTS)}
+AQI_TABLE = np.array([AQI_BREAKPOINTS[p] for p in AQI_BREAKPOINTS], dtype=float)
+
+# Candidate models compared for each pollutant
+CANDIDATE_MODELS = ('RandomForest', 'GradientBoosting')
+
+# Incremental updates add this many trees per model; forests keep at most
+# INCREMENTAL_MAX_TREES (oldest dropped first) and boosting stops growing there
+INCREMENTAL_TREES = int(os.environ.get('INCREMENTAL_TREES', 10))
+INCREMENTAL_MAX_TREES = int(os.environ.get('INCREMENTAL_MAX_TREES', 300))
+
+# Forecast hours predicted by direct multi-horizon models; hours in between are
+# interpolated and hours past the last one hold its value. FORECAST_METHOD picks
+# the default path when both are trained: 'recursive' or 'direct'
+DIRECT_HORIZONS = (0, 1, 3, 6, 12, 24, 48, 72)
+FORECAST_METHOD = os.environ.get('FORECAST_METHOD', 'recursive')
+DIRECT_SUFFIX = '_direct'
+
+# Hours of history prepare_features needs before a row: the longest lag and rolling window
+FEATURE_HISTORY_HOURS = 24
+
+# Training matrix shared with pool workers, set once per worker by the pool initializer
+_TRAINING_DATA = {}
+
+def build_candidate_model(name, n_jobs=1, params=None):
+    """Create an untrained candidate model; params override the default hyperparameters"""
+    from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor, RandomForestRegressor
+    
+    if name == 'RandomForest':
+        model = RandomForestRegressor(
+            n_estimators=100,
+            max_depth=15,
+            random_state=42,
+            n_jobs=n_jobs
+        )
+    elif name == 'GradientBoosting':
+        model = GradientBoostingRegressor(
+            n_estimators=100,
+            max_depth=6,
+            learning_rate=0.1,
+            random_state=42
+        )
+    elif name == 'HistGradientBoosting':
+        model = HistGradientBoostingRegressor(
+            max_iter=200,
+            learning_rate=0.1,
+            random_state=42
+        )
+    else:
+        raise ValueError(f"Unknown model: {name}")
+    return model.set_params(**(params or {}))
+
+def _init_training_worker(X_path, shape, targets):
+    """Map the spooled, scaled feature matrix and share the target arrays with a training worker"""
+    _TRAINING_DATA['X'] = np.memmap(X_path, dtype=np.float32, mode='r', shape=shape)
+    _TRAINING_DATA['targets'] = targets
+
+def _fit_candidate(task):
+    """Fit and evaluate one (target, candidate model) pair"""
+    from sklearn.metrics import mean_absolute_error
+    
+    target, name, params, train_rows, test_rows, n_jobs = task
+    start = time.perf_counter()
+    
+    X = _TRAINING_DATA['X']
+    y = _TRAINING_DATA['targets'][target]
+    model = build_candidate_model(name, n_jobs, params)
+    _fit_limited(model, X[train_rows], y[train_rows], n_jobs)
+    
+    # Evaluate model
+    mae = mean_absolute_error(y[test_rows], model.predict(X[test_rows]))
+    return target, name, model, mae, time.perf_counter() - start
+
+def _fit_limited(model, X, y, n_jobs):
+    """Fit a model, keeping OpenMP-threaded estimators to n_jobs threads inside pool workers"""
+    if n_jobs > 0 and not hasattr(model, 'n_jobs'):
+        from threadpoolctl import threadpool_limits
+        
+        with threadpool_limits(limits=n_jobs, user_api='openmp'):
+            return model.fit(X, y)
+    return model.fit(X, y)
+
+def _n_trees(model):
+    """Trees (boosting iterations) in a fitted ensemble"""
+    return model.n_iter_ if hasattr(model, 'n_iter_') else len(model.estimators_)
+
+def _forward_fill(values, last):
+    """Forward fill NaNs down the columns of a 2D array, continuing from the previous chunk's last row"""
+    values = np.vstack([last[np.newaxis], values])
+    rows = np.where(np.isnan(values), 0, np.arange(len(values))[:, np.newaxis])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return values[rows, np.arange(values.shape[1])][1:]
+
+def _record_training_stages(prefix, stats):
+    """Export the stage times of a training run as prefix_<stage> stages"""
+    for stage in ('prepare_features', 'scaling', 'selection', 'fit', 'compile', 'total'):
+        if stage in stats:
+            registry.observe('airsense_stage_duration_seconds', stats[stage], stage=f'{prefix}_{stage}')
+
+def read_latest_version(base_path=DEFAULT_MODEL_DIR):
+    """Get the model version LATEST points to, or None for unversioned models"""
+    latest_path = f'{base_path}/LATEST'
+    if not os.path.exists(latest_path):
+        return None
+    with open(latest_path) as f:
+        return f.read().strip()
+
+def list_model_versions(base_path=DEFAULT_MODEL_DIR):
+    """Saved model versions in base_path, oldest first"""
+    versions = []
+    for entry in os.scandir(base_path) if os.path.isdir(base_path) else []:
+        if entry.is_dir(follow_symlinks=False) and (
+                os.path.exists(os.path.join(entry.path, BUNDLE_FILENAME))
+                or any(name.endswith('_model.pkl') for name in os.listdir(entry.path))):
+            versions.append((entry.stat().st_mtime, entry.name))
+    return [name for _, name in sorted(versions)]
+
+def prune_model_versions(base_path=DEFAULT_MODEL_DIR, keep=MODEL_KEEP_VERSIONS, protect=()):
+    """Remove all but the newest keep versions, never LATEST's or one in protect; returns the removed versions.
+    
+    Processes that already loaded a removed version keep serving it: its
+    memory-mapped bundle stays readable until they swap to a newer one.
+    """
+    if keep <= 0:
+        return []
+    protected = set(protect) | {read_latest_version(base_path)}
+    versions = list_model_versions(base_path)
+    removed = [version for version in versions[:-keep] if version not in protected]
+    for version in removed:
+        shutil.rmtree(os.path.join(base_path, version), ignore_errors=True)
+    if removed:
+        print(f"Removed {len(removed)} old model versions from {base_path}")
+    return removed
+
 class AirQualityForecaster:
     def __init__(self):
         self.models = {}
         self.scalers = {}
+        self.running_scalers = {}
         self.feature_columns = [
             'temperature', 'humidity', 'wind_speed', 'pressure',
             'hour', 'day_of_week', 'month', 'season'
         ]
         self.target_columns = ['pm25', 'pm10', 'co2', 'no2', 'so2', 'o3']
-        
-    def generate_synthetic_data(self, n_samples=10000):
+        self.model_features = []
+        self.model_version = None
+        self.compiled_models = {}
+        self.direct_models = {}
+        self.compiled_direct_models = {}
+        self.direct_horizons = DIRECT_HORIZONS
+        self.training_stats = {}
+        self.selection_results = None
+    
+    def generate_synthetic_data(self, n_samples=10000, seed=42, start_date='2020-01-01'):
         """Generate synthetic air quality data for training"""
-        np.random.seed(42)
-        
-        # Generate time series
-        start_date = datetime(2020, 1, 1)
-        dates = [start_date + timedelta(hours=i) for i in range(n_samples)]
-        
-        data = []
-        for i, date in enumerate(dates):
-            # Weather features with seasonal patterns
-            season = (date.month - 1) // 3  # 0-3 for seasons
-            hour = date.hour
-            day_of_week = date.weekday()
-            month = date.month
-            
-            # Temperature with seasonal variation
-            base_temp = 15 + 10 * np.sin(2 * np.pi * (date.timetuple().tm_yday - 80) / 365)
-            temperature = base_temp + np.random.normal(0, 5)
-            
-            # Humidity
-            humidity = 50 + 20 * np.sin(2 * np.pi * date.timetuple().tm_yday / 365) + np.random.normal(0, 10)
-            humidity = np.clip(humidity, 20, 90)
-            
-            # Wind speed
-            wind_speed = 5 + 3 * np.random.exponential(1)
-            wind_speed = np.clip(wind_speed, 0, 20)
-            
-            # Pressure
-            pressure = 1013 + np.random.normal(0, 15)
-            
-            # Air quality parameters with realistic patterns
-            # PM2.5 - higher in winter, during rush hours, lower wind
-            pm25_base = 25 + 15 * (season == 0 or season == 3)  # Higher in winter/fall
-            pm25_base += 10 * (7 <= hour <= 9 or 17 <= hour <= 19)  # Rush hours
-            pm25_base += max(0, 15 - wind_speed)  # Lower wind = higher pollution
-            pm25 = max(0, pm25_base + np.random.normal(0, 8))
-            
-            # PM10 - correlated with PM2.5 but higher
-            pm10 = pm25 * 1.5 + np.random.normal(0, 5)
-            pm10 = max(0, pm10)
-            
-            # CO2 - higher during day, traffic patterns
-            co2_base = 400 + 50 * (6 <= hour <= 22)  # Higher during day
-            co2_base += 30 * (7 <= hour <= 9 or 17 <= hour <= 19)  # Rush hours
-            co2 = co2_base + np.random.normal(0, 20)
-            
-            # NO2 - traffic related
-            no2_base = 20 + 15 * (7 <= hour <= 9 or 17 <= hour <= 19)
-            no2_base += 10 * (day_of_week < 5)  # Higher on weekdays
-            no2 = max(0, no2_base + np.random.normal(0, 5))
-            
-            # SO2 - industrial, seasonal
-            so2_base = 10 + 5 * (season == 0)  # Higher in winter
-            so2 = max(0, so2_base + np.random.normal(0, 3))
-            
-            # O3 - photochemical, higher in summer, midday
-            o3_base = 30 + 20 * (season == 1)  # Higher in summer
-            o3_base += 15 * (10 <= hour <= 16)  # Higher midday
-            o3 = max(0, o3_base + np.random.normal(0, 8))
-            
-            data.append({
-                'datetime': date,
-                'temperature': temperature,
-                'humidity': humidity,
-                'wind_speed': wind_speed,
-                'pressure': pressure,
-                'hour': hour,
-                'day_of_week': day_of_week,
-                'month': month,
-                'season': season,
-                'pm25': pm25,
-                'pm10': pm10,
-                'co2': co2,
-                'no2': no2,
-                'so2': so2,
-                'o3': o3
-            })
-        
-        return pd.DataFrame(data)
+        import pandas as pd
+        
+        return self._synthetic_chunk(pd.date_range(start_date, periods=n_samples, freq='H'),
+                                     np.random.default_rng(seed))
+    
+    def iter_synthetic_data(self, n_samples, chunk_size=100000, seed=42, start_date='2020-01-01'):
+        """Yield synthetic data in fixed-size DataFrame chunks so large datasets fit in bounded memory"""
+        import pandas as pd
+        
+        seeds = np.random.SeedSequence(seed)
+        start = pd.Timestamp(start_date)
+        
+        for offset in range(0, n_samples, chunk_size):
+            dates = pd.date_range(start + pd.Timedelta(hours=offset),
+                                  periods=min(chunk_size, n_samples - offset), freq='H')
+            # Each chunk draws from its own child stream, so chunks are reproducible independently
+            yield self._synthetic_chunk(dates, np.random.default_rng(seeds.spawn(1)[0]))
+    
+    def write_synthetic_data(self, path, n_samples, chunk_size=100000, file_format='parquet', seed=42,
+                             start_date='2020-01-01'):
+        """Write synthetic data as numbered Parquet or CSV shards, one chunk at a time"""
+        if file_format not in ('parquet', 'csv'):
+            raise ValueError(f"Unsupported format: {file_format}")
+        os.makedirs(path, exist_ok=True)
+        
+        shards = []
+        chunks = self.iter_synthetic_data(n_samples, chunk_size=chunk_size, seed=seed, start_date=start_date)
+        for i, chunk in enumerate(chunks):
+            shard_path = f'{path}/part-{i:05d}.{file_format}'
+            if file_format == 'parquet':
+                chunk.to_parquet(shard_path, index=False)
+            else:
+                chunk.to_csv(shard_path, index=False)
+            shards.append(shard_path)
+        
+        print(f"Wrote {len(shards)} {file_format} shards to {path}")
+        return shards
+    
+    def _synthetic_chunk(self, dates, rng):
+        """Generate synthetic rows for the given hourly timestamps using vectorized noise"""
+        import pandas as pd
+        
+        n = len(dates)
+        
+        # Weather features with seasonal patterns
+        hour = dates.hour.to_numpy().astype(np.int64)
+        day_of_week = dates.dayofweek.to_numpy().astype(np.int64)
+        month = dates.month.to_numpy().astype(np.int64)
+        season = (month - 1) // 3  # 0-3 for seasons
+        day_of_year = dates.dayofyear.to_numpy().astype(np.int64)
+        rush_hour = ((7 <= hour) & (hour <= 9)) | ((17 <= hour) & (hour <= 19))
+        
+        # Temperature with seasonal variation
+        base_temp = 15 + 10 * np.sin(2 * np.pi * (day_of_year - 80) / 365)
+        temperature = base_temp + rng.normal(0, 5, n)
+        
+        # Humidity
+        humidity = 50 + 20 * np.sin(2 * np.pi * day_of_year / 365) + rng.normal(0, 10, n)
+        humidity = np.clip(humidity, 20, 90)
+        
+        # Wind speed
+        wind_speed = np.clip(5 + 3 * rng.exponential(1, n), 0, 20)
+        
+        # Pressure
+        pressure = 1013 + rng.normal(0, 15, n)
+        
+        # Air quality parameters with realistic patterns
+        # PM2.5 - higher in winter, during rush hours, lower wind
+        pm25_base = 25 + 15 * ((season == 0) | (season == 3))  # Higher in winter/fall
+        pm25_base = pm25_base + 10 * rush_hour  # Rush hours
+        pm25_base = pm25_base + np.maximum(0, 15 - wind_speed)  # Lower wind = higher pollution
+        pm25 = np.maximum(0, pm25_base + rng.normal(0, 8, n))
+        
+        # PM10 - correlated with PM2.5 but higher
+        pm10 = np.maximum(0, pm25 * 1.5 + rng.normal(0, 5, n))
+        
+        # CO2 - higher during day, traffic patterns
+        co2_base = 400 + 50 * ((6 <= hour) & (hour <= 22))  # Higher during day
+        co2_base = co2_base + 30 * rush_hour  # Rush hours
+        co2 = co2_base + rng.normal(0, 20, n)
+        
+        # NO2 - traffic related
+        no2_base = 20 + 15 * rush_hour + 10 * (day_of_week < 5)  # Higher on weekdays
+        no2 = np.maximum(0, no2_base + rng.normal(0, 5, n))
+        
+        # SO2 - industrial, seasonal
+        so2_base = 10 + 5 * (season == 0)  # Higher in winter
+        so2 = np.maximum(0, so2_base + rng.normal(0, 3, n))
+        
+        # O3 - photochemical, higher in summer, midday
+        o3_base = 30 + 20 * (season == 1)  # Higher in summer
+        o3_base = o3_base + 15 * ((10 <= hour) & (hour <= 16))  # Higher midday
+        o3 = np.maximum(0, o3_base + rng.normal(0, 8, n))
+        
+        return pd.DataFrame({
+            'datetime': dates,
+            'temperature': temperature,
+            'humidity': humidity,
+            'wind_speed': wind_speed,
+            'pressure': pressure,
+            'hour': hour,
+            'day_of_week': day_of_week,
+            'month': month,
+            'season': season,
+            'pm25': pm25,
+            'pm10': pm10,
+            'co2': co2,
+            'no2': no2,
+            'so2': so2,
+            'o3': o3
+        })
     
     def prepare_features(self, df):
         """Prepare features for training"""
@@ -120,165 +324,611 @@ class AirQualityForecaster:
         
         return df
     
-    def train_models(self, df):
-        """Train forecasting models for each pollutant"""
-        df = self.prepare_features(df)
+    def prepare_features_chunks(self, chunks):
+        """Run prepare_features over consecutive DataFrame chunks, carrying history across chunk boundaries"""
+        import pandas as pd
         
-        # Get all feature columns (including lag and rolling features)
-        feature_cols = [col for col in df.columns if col not in self.target_columns + ['datetime']]
+        history = None
+        for chunk in chunks:
+            n_history = 0
+            if history is not None:
+                n_history = len(history)
+                chunk = pd.concat([history, chunk], ignore_index=True)
+            history = chunk.iloc[-FEATURE_HISTORY_HOURS:].copy()
+            yield self.prepare_features(chunk).iloc[n_history:]
+    
+    def train_models(self, data, n_workers=None, direct=False, select=False, grid=None):
+        """Train forecasting models for each pollutant from a DataFrame or an iterable of DataFrame chunks.
         
-        for target in self.target_columns:
-            if target not in df.columns:
-                continue
+        With direct, also train one multi-output forest per pollutant that
+        predicts every hour in DIRECT_HORIZONS from the current features at once.
+        With select, each pollutant's model configuration is chosen from grid
+        (see model_selection.select_models) by time-series cross-validation on
+        the training rows instead of comparing CANDIDATE_MODELS on the test rows.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        import pandas as pd
+        from sklearn.model_selection import train_test_split
+        from sklearn.preprocessing import StandardScaler
+        
+        stats = {}
+        total_start = time.perf_counter()
+        chunks = [data] if isinstance(data, pd.DataFrame) else data
+        
+        # Feature rows are spooled to a float32 file as each chunk is prepared, so
+        # memory does not grow with the dataset until the models are fitted
+        fd, X_path = tempfile.mkstemp(prefix='aqf-features-', suffix='.f32', dir=os.environ.get('TRAINING_SPOOL_DIR'))
+        try:
+            stage_start = time.perf_counter()
+            with os.fdopen(fd, 'wb') as spool:
+                feature_cols, targets = self._spool_features(chunks, spool)
+            self.model_features = feature_cols
+            n_rows = len(next(iter(targets.values()), []))
+            
+            splits = {}
+            for target in list(targets):
+                # Remove rows with NaN targets
+                rows = np.flatnonzero(~np.isnan(targets[target]))
+                if len(rows) == 0:
+                    del targets[target]
+                    continue
                 
-            print(f"Training model for {target}...")
+                # Split data
+                train_rows, test_rows = train_test_split(rows, test_size=0.2, random_state=42, shuffle=False)
+                splits[target] = (train_rows, test_rows)
             
-            # Prepare data
-            X = df[feature_cols].fillna(method='ffill').fillna(0)
-            y = df[target].fillna(method='ffill')
+            # Direct targets: the value DIRECT_HORIZONS hours after each row
+            fit_targets = dict(targets)
+            if direct:
+                for target in list(targets):
+                    Y = np.full((n_rows, len(self.direct_horizons)), np.nan, dtype=np.float32)
+                    for j, hours in enumerate(self.direct_horizons):
+                        Y[:max(0, n_rows - hours), j] = targets[target][hours:]
+                    rows = np.flatnonzero(~np.isnan(Y).any(axis=1))
+                    if len(rows) < 5:
+                        continue
+                    fit_targets[f'{target}{DIRECT_SUFFIX}'] = Y
+                    splits[f'{target}{DIRECT_SUFFIX}'] = train_test_split(rows, test_size=0.2, random_state=42,
+                                                                          shuffle=False)
+            stats['prepare_features'] = time.perf_counter() - stage_start
+            stats['rows'] = n_rows
             
-            # Remove rows with NaN targets
-            mask = ~y.isna()
-            X = X[mask]
-            y = y[mask]
+            if not targets:
+                return
             
-            if len(X) == 0:
-                continue
+            # Scale features once, fitted on the training portion, in place chunk by chunk
+            stage_start = time.perf_counter()
+            X_scaled = np.memmap(X_path, dtype=np.float32, mode='r+', shape=(n_rows, len(feature_cols)))
+            n_train = max(len(train_rows) for train_rows, _ in splits.values())
+            step = DEFAULT_CHUNK_SIZE
+            scaler = StandardScaler()
+            for start in range(0, n_train, step):
+                scaler.partial_fit(pd.DataFrame(X_scaled[start:min(start + step, n_train)], columns=feature_cols))
+            for start in range(0, n_rows, step):
+                X_scaled[start:start + step] = scaler.transform(
+                    pd.DataFrame(X_scaled[start:start + step], columns=feature_cols))
+            X_scaled.flush()
+            stats['scaling'] = time.perf_counter() - stage_start
             
-            # Split data
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42, shuffle=False
-            )
+            n_workers = n_workers or os.cpu_count() or 1
+            shape = (n_rows, len(feature_cols))
+            choices = {target: [(name, None) for name in CANDIDATE_MODELS] for target in targets}
+            if select:
+                from model_selection import select_models
+                
+                stage_start = time.perf_counter()
+                self.selection_results = select_models(X_path, shape, targets,
+                                                       {target: splits[target][0] for target in targets},
+                                                       grid, n_workers=n_workers)
+                for target, result in self.selection_results['targets'].items():
+                    best = result['candidates'][result['best']]
+                    choices[target] = [(best['model'], best['params'])]
+                stats['selected'] = {target: result['best']
+                                     for target, result in self.selection_results['targets'].items()}
+                stats['selection'] = time.perf_counter() - stage_start
             
-            # Scale features
-            scaler = StandardScaler()
-            X_train_scaled = scaler.fit_transform(X_train)
-            X_test_scaled = scaler.transform(X_test)
+            # Fan (target x candidate model) fits out across a process pool; workers map the same file
+            stage_start = time.perf_counter()
+            tasks = [(target, name, params, splits[target][0], splits[target][1])
+                     for target in targets for name, params in choices[target]]
+            tasks += [(key, 'RandomForest', None, splits[key][0], splits[key][1])
+                      for key in fit_targets if key not in targets]
+            n_jobs = max(1, n_workers // len(tasks))
             
-            # Train Random Forest
-            rf_model = RandomForestRegressor(
-                n_estimators=100,
-                max_depth=15,
-                random_state=42,
-                n_jobs=-1
-            )
-            rf_model.fit(X_train_scaled, y_train)
+            if n_workers > 1:
+                with ProcessPoolExecutor(max_workers=min(n_workers, len(tasks)), initializer=_init_training_worker,
+                                         initargs=(X_path, shape, fit_targets)) as pool:
+                    results = list(pool.map(_fit_candidate, [task + (n_jobs,) for task in tasks]))
+            else:
+                _init_training_worker(X_path, shape, fit_targets)
+                results = [_fit_candidate(task + (-1,)) for task in tasks]
+                _TRAINING_DATA.clear()
+            stats['fit'] = time.perf_counter() - stage_start
             
-            # Train Gradient Boosting
-            gb_model = GradientBoostingRegressor(
-                n_estimators=100,
-                max_depth=6,
-                learning_rate=0.1,
-                random_state=42
-            )
-            gb_model.fit(X_train_scaled, y_train)
+            # Choose best model
+            candidates = {}
+            for target, name, model, mae, _ in results:
+                candidates.setdefault(target, []).append((mae, name, model))
             
-            # Evaluate models
-            rf_pred = rf_model.predict(X_test_scaled)
-            gb_pred = gb_model.predict(X_test_scaled)
+            self.direct_models = {}
+            for key in fit_targets:
+                if key not in targets:
+                    mae, _, model = candidates[key][0]
+                    print(f"{key[:-len(DIRECT_SUFFIX)]} - Direct {len(self.direct_horizons)}-horizon model, MAE: {mae:.2f}")
+                    self.direct_models[key[:-len(DIRECT_SUFFIX)]] = model
             
-            rf_mae = mean_absolute_error(y_test, rf_pred)
-            gb_mae = mean_absolute_error(y_test, gb_pred)
+            for target in targets:
+                mae, model_type, best_model = min(candidates[target], key=lambda candidate: candidate[0])
+                print(f"{target} - Best model: {model_type}, MAE: {mae:.2f}")
+                
+                # Store model and scaler
+                self.models[target] = best_model
+                self.scalers[target] = scaler
             
-            # Choose best model
-            if rf_mae < gb_mae:
-                best_model = rf_model
-                model_type = 'RandomForest'
-            else:
-                best_model = gb_model
-                model_type = 'GradientBoosting'
+            stats['fit_tasks'] = sum(result[4] for result in results)
+            self.running_scalers = {}
             
-            print(f"{target} - Best model: {model_type}, MAE: {min(rf_mae, gb_mae):.2f}")
+            # Export the selected models for fast inference, verified on held-out rows
+            stage_start = time.perf_counter()
+            check_rows = np.unique(np.concatenate([test_rows for _, test_rows in splits.values()]))
+            self.compile_models(np.array(X_scaled[check_rows[:256]]))
+            stats['compile'] = time.perf_counter() - stage_start
+            del X_scaled
+        finally:
+            os.remove(X_path)
+        
+        stats['total'] = time.perf_counter() - total_start
+        self.training_stats = stats
+        _record_training_stages('train', stats)
+        print("Training stages: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stats.items()
+                                              if isinstance(seconds, float)))
+    
+    def _spool_features(self, chunks, spool):
+        """Prepare features chunk by chunk, writing float32 feature rows to spool; returns (feature columns, targets)"""
+        feature_cols = None
+        target_chunks = {}
+        last_features = last_targets = None
+        
+        for chunk in self.prepare_features_chunks(chunks):
+            if feature_cols is None:
+                feature_cols = [col for col in chunk.columns if col not in self.target_columns + ['datetime']]
+                target_cols = [col for col in self.target_columns if col in chunk.columns]
+                last_features = np.full(len(feature_cols), np.nan, dtype=np.float32)
+                last_targets = np.full(len(target_cols), np.nan, dtype=np.float32)
             
-            # Store model and scaler
-            self.models[target] = best_model
-            self.scalers[target] = scaler
+            # Forward fill across chunk boundaries, as training on one DataFrame would
+            X = _forward_fill(chunk.reindex(columns=feature_cols).to_numpy(dtype=np.float32), last_features)
+            y = _forward_fill(chunk.reindex(columns=target_cols).to_numpy(dtype=np.float32), last_targets)
+            if len(X):
+                last_features, last_targets = X[-1], y[-1]
+            
+            spool.write(np.nan_to_num(X, nan=0.0).tobytes())
+            for i, target in enumerate(target_cols):
+                target_chunks.setdefault(target, []).append(y[:, i])
+        
+        if feature_cols is None:
+            return [], {}
+        return feature_cols, {target: np.concatenate(parts) for target, parts in target_chunks.items()}
     
-    def predict_forecast(self, current_data, hours_ahead=24):
-        """Generate forecast for specified hours ahead"""
-        forecasts = {}
+    def check_update_data(self, df, name="New samples"):
+        """Raise ValueError unless df has rows with every raw column update_models needs, all numeric"""
+        import pandas as pd
+        
+        if len(df) == 0:
+            raise ValueError(f"{name} have no rows")
+        # Lag and rolling features are derived from the target columns
+        derived = tuple(f'{target}_' for target in self.target_columns)
+        required = [col for col in self.get_model_features() if not col.startswith(derived)] + list(self.models)
+        missing = [col for col in required if col not in df.columns]
+        if missing:
+            raise ValueError(f"{name} are missing columns: {', '.join(missing)}")
+        not_numeric = [col for col in required if not pd.api.types.is_numeric_dtype(df[col])]
+        if not_numeric:
+            raise ValueError(f"{name} have non-numeric columns: {', '.join(not_numeric)}")
+    
+    def update_models(self, data, history=None, n_trees=INCREMENTAL_TREES, n_workers=None):
+        """Update the trained models with newly arrived samples instead of retraining from scratch.
+        
+        Forests grow n_trees trees on the new rows and boosting adds n_trees
+        more stages fitted to them. Every tree keeps the scaling the models
+        were trained with, so the existing trees predict exactly as before;
+        the running scaler statistics absorb the new rows and the largest
+        feature mean shift is reported. history holds the hours just before
+        data, so its lag and rolling features are complete. The last 20% of
+        the new rows is held out to compare each model's MAE before and after
+        the update. Direct models are left as they are; retrain to update them.
+        """
+        import copy
+        import pandas as pd
+        from sklearn.base import clone
+        from sklearn.metrics import mean_absolute_error
+        from sklearn.model_selection import train_test_split
+        
+        if not self.models:
+            raise ValueError("No trained models to update")
+        if any(isinstance(model, FlatEnsemble) for model in self.models.values()):
+            raise ValueError("Incremental updates need the sklearn estimators; load them with load_models")
+        
+        stats = {'mode': 'incremental'}
+        total_start = time.perf_counter()
+        cpu_start = time.process_time()
         
-        # Prepare current data
-        df = pd.DataFrame([current_data])
+        stage_start = time.perf_counter()
+        chunks = [data] if isinstance(data, pd.DataFrame) else list(data)
+        new = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        self.check_update_data(new)
+        if history is not None:
+            self.check_update_data(history, "History rows")
+        df = pd.concat(([history] if history is not None else []) + [new], ignore_index=True)
+        n_history = 0 if history is None else len(history)
         df = self.prepare_features(df)
         
-        # Get feature columns
-        feature_cols = [col for col in df.columns if col not in self.target_columns + ['datetime']]
+        feature_cols = self.get_model_features()
+        X = df[feature_cols].ffill().fillna(0).iloc[n_history:].to_numpy(dtype=np.float32)
+        stats['rows'] = len(X)
         
-        for target in self.target_columns:
-            if target not in self.models:
+        # Hold out the latest rows for the before/after comparison, unless there are too few
+        rows = np.arange(len(X))
+        train_rows, test_rows = (train_test_split(rows, test_size=0.2, shuffle=False) if len(rows) >= 5
+                                 else (rows, rows[:0]))
+        stats['prepare_features'] = time.perf_counter() - stage_start
+        
+        # Trees only compare each feature with their split thresholds, so the fitted trees and the new ones keep
+        # the scaling the models were trained with and predict exactly as before on the same inputs. The running
+        # mean and variance absorb the new training rows alongside, to show how far the data has moved.
+        stage_start = time.perf_counter()
+        scaled = {}
+        running = {}
+        stats['feature_shift'] = {}
+        for target in self.models:
+            scaler = self.scalers[target]
+            if id(scaler) not in scaled:
+                scaled[id(scaler)] = scaler.transform(pd.DataFrame(X, columns=feature_cols))
+            running[target] = copy.deepcopy(self.running_scalers.get(target, scaler))
+            running[target].partial_fit(pd.DataFrame(X[train_rows], columns=feature_cols))
+            # Largest move of a feature mean since the fit, in the fitted standard deviations
+            stats['feature_shift'][target] = float(np.max(np.abs(running[target].mean_ - scaler.mean_) / scaler.scale_))
+        self.running_scalers = running
+        stats['scaling'] = time.perf_counter() - stage_start
+        
+        stage_start = time.perf_counter()
+        stats['mae_before'] = {}
+        stats['mae_after'] = {}
+        stats['trees'] = {}
+        for target, model in self.models.items():
+            if target not in df.columns:
+                continue
+            X_scaled = scaled[id(self.scalers[target])]
+            y = df[target].ffill().iloc[n_history:].to_numpy(dtype=float)
+            known = ~np.isnan(y)
+            fit_rows, eval_rows = train_rows[known[train_rows]], test_rows[known[test_rows]]
+            if len(fit_rows) == 0:
                 continue
             
-            predictions = []
-            current_features = df[feature_cols].fillna(0).iloc[0].values
+            if len(eval_rows):
+                stats['mae_before'][target] = mean_absolute_error(y[eval_rows], model.predict(X_scaled[eval_rows]))
             
-            for hour in range(hours_ahead):
-                # Scale features
-                scaled_features = self.scalers[target].transform([current_features])
-                
-                # Predict
-                pred = self.models[target].predict(scaled_features)[0]
-                pred = max(0, pred)  # Ensure non-negative
-                predictions.append(pred)
-                
-                # Update features for next prediction (simplified)
-                # In practice, you'd update weather features based on weather forecast
-                current_features = current_features.copy()
-                if len(current_features) > len(self.feature_columns):
-                    # Update lag features
-                    current_features[-len(self.target_columns):] = pred
+            n_existing = _n_trees(model)
+            if type(model).__name__ == 'RandomForestRegressor':
+                model.set_params(warm_start=True, n_estimators=n_existing + n_trees, n_jobs=n_workers or -1)
+                model.fit(X_scaled[fit_rows], y[fit_rows])
+                # Keep a sliding window of the newest trees
+                model.estimators_ = model.estimators_[-INCREMENTAL_MAX_TREES:]
+                model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+            elif type(model).__name__ == 'GradientBoostingRegressor':
+                if n_existing + n_trees > INCREMENTAL_MAX_TREES:
+                    print(f"{target}: boosting has {n_existing} stages, run a full retrain to update it")
+                else:
+                    model.set_params(warm_start=True, n_estimators=n_existing + n_trees)
+                    model.fit(X_scaled[fit_rows], y[fit_rows])
+                    model.set_params(warm_start=False)
+            elif type(model).__name__ == 'HistGradientBoostingRegressor':
+                if n_existing + n_trees > INCREMENTAL_MAX_TREES:
+                    print(f"{target}: boosting has {n_existing} iterations, run a full retrain to update it")
+                else:
+                    # Warm starting would rebin the new rows but replay the existing trees' bin thresholds
+                    # against the new bins; boost the residuals separately and append the new trees instead
+                    booster = clone(model).set_params(max_iter=n_trees, early_stopping=False, warm_start=False)
+                    booster.fit(X_scaled[fit_rows], y[fit_rows] - model.predict(X_scaled[fit_rows]))
+                    first = booster._predictors[0][0].nodes
+                    first['value'][first['is_leaf'] == 1] += np.ravel(booster._baseline_prediction)[0]
+                    model._predictors += booster._predictors
+            else:
+                raise ValueError(f"Incremental updates are not supported for {type(model).__name__}")
+            stats['trees'][target] = _n_trees(model)
+            
+            if len(eval_rows):
+                stats['mae_after'][target] = mean_absolute_error(y[eval_rows], model.predict(X_scaled[eval_rows]))
+                print(f"{target} - MAE before update: {stats['mae_before'][target]:.2f}, "
+                      f"after: {stats['mae_after'][target]:.2f}")
+        stats['fit'] = time.perf_counter() - stage_start
+        
+        stage_start = time.perf_counter()
+        self.compile_models()
+        stats['compile'] = time.perf_counter() - stage_start
+        stats['total'] = time.perf_counter() - total_start
+        stats['cpu'] = time.process_time() - cpu_start
+        self.training_stats = stats
+        _record_training_stages('update', stats)
+        print("Update stages: " + ", ".join(f"{stage} {value:.2f}s" for stage, value in stats.items()
+                                            if stage in ('prepare_features', 'scaling', 'fit', 'compile', 'total')))
+    
+    def predict_forecast(self, current_data, hours_ahead=24, method=None):
+        """Generate forecast for specified hours ahead"""
+        return self.predict_forecast_batch([current_data], [hours_ahead], method)[0]
+    
+    def predict_forecast_batch(self, conditions, hours_ahead=24, method=None):
+        """Generate forecasts for many locations in one batched pass; hours_ahead may be per location.
+        
+        method is 'recursive' or 'direct' (default FORECAST_METHOD); direct
+        falls back to recursive unless every target has a direct model.
+        """
+        if isinstance(hours_ahead, (list, tuple)):
+            horizons = [max(0, int(hours)) for hours in hours_ahead]
+        else:
+            horizons = [max(0, int(hours_ahead))] * len(conditions)
+        
+        targets, raw, scaling = self._prepare_batch(conditions)
+        if not targets:
+            return [{} for _ in conditions]
+        
+        # Run every location to the longest horizon together, then trim each one
+        with time_stage('model_predict'):
+            if self._use_direct(targets, method):
+                predictions = self._direct_forecast(targets, raw, max(horizons, default=0), scaling)
+            else:
+                predictions = self._recursive_forecast(targets, raw, max(horizons, default=0), scaling)
+        
+        return [{target: predictions[i, row, :horizon].tolist() for i, target in enumerate(targets)}
+                for row, horizon in enumerate(horizons)]
+    
+    def iter_forecast_batch(self, conditions, hours_ahead=24, method=None, block_hours=1):
+        """Generate forecasts for many locations, yielding each block of hours as soon as it is computed.
+        
+        Yields (first hour, {target: (locations x hours) array}) for consecutive
+        blocks of up to block_hours hours until hours_ahead, with the same
+        values as predict_forecast_batch. Recursive forecasts step every target
+        one hour at a time, so the first block is ready after block_hours steps
+        however long the horizon is.
+        """
+        hours_ahead = max(0, int(hours_ahead))
+        block_hours = max(1, int(block_hours))
+        targets, raw, scaling = self._prepare_batch(conditions)
+        if not targets:
+            return
+        
+        if self._use_direct(targets, method):
+            predictions = self._direct_forecast(targets, raw, hours_ahead, scaling)
+            blocks = ((start, predictions[:, :, start:start + block_hours])
+                      for start in range(0, hours_ahead, block_hours))
+        else:
+            blocks = self._iter_recursive_forecast(targets, raw, hours_ahead, block_hours, scaling)
+        for start, block in blocks:
+            yield start, {target: block[i] for i, target in enumerate(targets)}
+    
+    def _prepare_batch(self, conditions):
+        """Targets with models, raw input rows and their scaling for a batch of current conditions"""
+        targets = [target for target in self.target_columns if target in self.models]
+        if not targets:
+            return targets, None, None
+        
+        with time_stage('model_features'):
+            feature_cols = self.get_model_features()
+            raw = np.array([self._feature_vector(current_data, feature_cols) for current_data in conditions],
+                           dtype=float).reshape(len(conditions), len(feature_cols))
+        
+        with time_stage('model_scaling'):
+            scaling = self._scale_batch(targets, raw)
+        return targets, raw, scaling
+    
+    def _use_direct(self, targets, method):
+        """Whether a forecast uses the direct models: asked for, and trained for every target"""
+        return (method or FORECAST_METHOD) == 'direct' and all(target in self.direct_models for target in targets)
+    
+    def get_model_features(self):
+        """Get the feature columns the trained models expect, in training order"""
+        if self.model_features:
+            return list(self.model_features)
+        
+        for scaler in self.scalers.values():
+            if hasattr(scaler, 'feature_names_in_'):
+                return list(scaler.feature_names_in_)
+        
+        # Models trained without column names: assume the standard prepare_features layout
+        lag_cols = [f'{col}_{lag}' for col in self.target_columns for lag in ('lag1', 'lag24')]
+        rolling_cols = [f'{col}_{window}' for col in self.target_columns for window in ('rolling_3h', 'rolling_24h')]
+        return self.feature_columns + lag_cols + rolling_cols
+    
+    def _feature_vector(self, current_data, feature_cols):
+        """Build one model input row from current conditions, matching prepare_features on a single row"""
+        row = []
+        for col in feature_cols:
+            value = current_data.get(col)
+            if value is None and '_' in col:
+                base, suffix = col.split('_', 1)
+                # A single observation has no history: lags are missing and rolling means equal the value
+                if base in self.target_columns and suffix.startswith('rolling'):
+                    value = current_data.get(base)
+            row.append(0.0 if value is None else float(value))
+        return row
+    
+    def _scaling_params(self, targets, n_features):
+        """Stack the per-target StandardScaler statistics into (targets x features) arrays"""
+        means = np.zeros((len(targets), n_features))
+        scales = np.ones((len(targets), n_features))
+        for i, target in enumerate(targets):
+            scaler = self.scalers[target]
+            if getattr(scaler, 'mean_', None) is not None:
+                means[i] = scaler.mean_
+            if getattr(scaler, 'scale_', None) is not None:
+                scales[i] = scaler.scale_
+        return means, scales
+    
+    def _scale_batch(self, targets, raw):
+        """Scaling statistics and every target's scaled view of a batch of input rows: (means, scales, scaled)"""
+        means, scales = self._scaling_params(targets, raw.shape[1])
+        scaled = (raw[np.newaxis, :, :] - means[:, np.newaxis, :]) / scales[:, np.newaxis, :]
+        return means, scales, scaled
+    
+    def _recursive_forecast(self, targets, raw, hours_ahead, scaling=None):
+        """Run the recursive multi-step forecast for a batch of input rows; returns (targets, rows, hours_ahead)"""
+        predictions = np.zeros((len(targets), raw.shape[0], max(0, int(hours_ahead))))
+        for start, block in self._iter_recursive_forecast(targets, raw, hours_ahead, scaling=scaling):
+            predictions[:, :, start:start + block.shape[2]] = block
+        return predictions
+    
+    def _iter_recursive_forecast(self, targets, raw, hours_ahead, block_hours=None, scaling=None):
+        """Run the recursive multi-step forecast for a batch of input rows hour by hour.
+        
+        Yields (first hour, (targets, rows, hours) array) for consecutive blocks
+        of block_hours hours (default the whole horizon) as soon as every
+        target has been stepped through them. Each step feeds the previous
+        prediction back into the trailing lag slots of the row, so a target's
+        state is fully determined by its last prediction. Tree ensembles are
+        piecewise constant, which makes those sequences settle into short
+        cycles; once a value repeats the rest of the horizon is filled in from
+        the cycle instead of calling the model again.
+        """
+        n_rows, n_features = raw.shape
+        hours_ahead = max(0, int(hours_ahead))
+        block_hours = max(1, int(block_hours or hours_ahead))
+        predictions = np.zeros((len(targets), n_rows, hours_ahead))
+        emitted = 0
+        
+        if hours_ahead > 0 and n_rows > 0:
+            means, scales, scaled = scaling or self._scale_batch(targets, raw)
+            n_lag = len(self.target_columns)
+            recursive = n_features > len(self.feature_columns)
             
-            forecasts[target] = predictions
+            # Step 0 inputs are known up front and already scaled for every target in one pass
+            models = [self._predictor(target, n_rows) for target in targets]
+            for i, model in enumerate(models):
+                predictions[i, :, 0] = np.maximum(0, model.predict(scaled[i]))
+            if not recursive:
+                predictions[:, :, 1:] = predictions[:, :, :1]
+            
+            # Step all targets together, one hour at a time, so early hours are final before later ones
+            steps = np.arange(hours_ahead)
+            active = [np.arange(n_rows) if recursive else steps[:0] for _ in targets]
+            for hour in range(1, hours_ahead):
+                if not any(len(rows) for rows in active):
+                    break
+                for i, model in enumerate(models):
+                    if len(active[i]) == 0:
+                        continue
+                    rows = raw[active[i]].copy()
+                    rows[:, -n_lag:] = predictions[i, active[i], hour - 1][:, np.newaxis]
+                    pred = model.predict((rows - means[i]) / scales[i])
+                    pred = np.maximum(0, pred)
+                    predictions[i, active[i], hour] = pred
+                    
+                    # Rows whose new prediction already occurred earlier have entered a cycle
+                    matches = predictions[i, active[i], :hour] == pred[:, np.newaxis]
+                    settled = matches.any(axis=1)
+                    if settled.any():
+                        start = matches[settled].argmax(axis=1)
+                        period = hour - start
+                        remaining = steps[hour + 1:]
+                        source = (start[:, np.newaxis]
+                                  + (remaining[np.newaxis, :] - start[:, np.newaxis]) % period[:, np.newaxis])
+                        settled_rows = active[i][settled]
+                        predictions[i, settled_rows, hour + 1:] = np.take_along_axis(
+                            predictions[i, settled_rows], source, axis=1
+                        )
+                        active[i] = active[i][~settled]
+                
+                while hour + 1 - emitted >= block_hours:
+                    yield emitted, predictions[:, :, emitted:emitted + block_hours]
+                    emitted += block_hours
         
-        return forecasts
+        # Every remaining hour is known once all rows settled or the horizon ended
+        for start in range(emitted, hours_ahead, block_hours):
+            yield start, predictions[:, :, start:start + block_hours]
+    
+    def _direct_forecast(self, targets, raw, hours_ahead, scaling=None):
+        """Forecast a batch of input rows with the direct multi-horizon models.
+        
+        Returns an array of shape (targets, rows, hours_ahead) at a cost of one
+        predict call per target whatever the horizon: the trained horizons are
+        predicted together and every other hour is interpolated linearly.
+        """
+        n_rows = raw.shape[0]
+        hours_ahead = max(0, int(hours_ahead))
+        predictions = np.zeros((len(targets), n_rows, hours_ahead))
+        if hours_ahead == 0 or n_rows == 0:
+            return predictions
+        
+        # (trained horizons x hours) weights, so interpolation is one matrix product
+        horizons = np.array(self.direct_horizons, dtype=float)
+        hours = np.arange(hours_ahead)
+        weights = np.array([np.interp(hours, horizons, unit) for unit in np.eye(len(horizons))])
+        
+        _, _, scaled = scaling or self._scale_batch(targets, raw)
+        for i, target in enumerate(targets):
+            anchors = self._predictor(target, n_rows, direct=True).predict(scaled[i])
+            predictions[i] = np.maximum(0, anchors).reshape(n_rows, len(horizons)) @ weights
+        
+        return predictions
     
     def calculate_aqi(self, pollutant_values):
         """Calculate AQI from pollutant concentrations"""
-        # Simplified AQI calculation (US EPA standard)
-        aqi_breakpoints = {
-            'pm25': [(0, 12, 0, 50), (12.1, 35.4, 51, 100), (35.5, 55.4, 101, 150), 
-                     (55.5, 150.4, 151, 200), (150.5, 250.4, 201, 300), (250.5, 500, 301, 500)],
-            'pm10': [(0, 54, 0, 50), (55, 154, 51, 100), (155, 254, 101, 150), 
-                     (255, 354, 151, 200), (355, 424, 201, 300), (425, 604, 301, 500)],
-            'co2': [(0, 400, 0, 50), (401, 1000, 51, 100), (1001, 2000, 101, 150), 
-                    (2001, 5000, 151, 200), (5001, 10000, 201, 300), (10001, 40000, 301, 500)],
-            'no2': [(0, 53, 0, 50), (54, 100, 51, 100), (101, 360, 101, 150), 
-                    (361, 649, 151, 200), (650, 1249, 201, 300), (1250, 2049, 301, 500)],
-            'so2': [(0, 35, 0, 50), (36, 75, 51, 100), (76, 185, 101, 150), 
-                    (186, 304, 151, 200), (305, 604, 201, 300), (605, 1004, 301, 500)],
-            'o3': [(0, 54, 0, 50), (55, 70, 51, 100), (71, 85, 101, 150), 
-                   (86, 105, 151, 200), (106, 200, 201, 300), (201, 400, 301, 500)]
-        }
-        
-        max_aqi = 0
-        
-        for pollutant, concentration in pollutant_values.items():
-            if pollutant not in aqi_breakpoints:
-                continue
+        pollutants = list(pollutant_values)
+        concentrations = np.array([pollutant_values[p] for p in pollutants], dtype=float).reshape(-1, 1)
+        aqi, _ = self.calculate_aqi_batch(concentrations, pollutants)
+        return int(aqi[0])
+    
+    def calculate_aqi_batch(self, concentrations, pollutants):
+        """Calculate AQI and the dominant pollutant for a (pollutants x hours) array"""
+        concentrations = np.asarray(concentrations, dtype=float)
+        sub_index = np.full(concentrations.shape, -np.inf)
+        
+        known = [i for i, p in enumerate(pollutants) if p in AQI_TABLE_INDEX]
+        if known:
+            table = AQI_TABLE[[AQI_TABLE_INDEX[pollutants[i]] for i in known]]
+            values = concentrations[known]
             
-            for bp_low, bp_high, aqi_low, aqi_high in aqi_breakpoints[pollutant]:
-                if bp_low <= concentration <= bp_high:
-                    aqi = ((aqi_high - aqi_low) / (bp_high - bp_low)) * (concentration - bp_low) + aqi_low
-                    max_aqi = max(max_aqi, aqi)
-                    break
+            # searchsorted over each pollutant's band lower bounds, broadcast across all hours at once
+            idx = (values[:, :, np.newaxis] >= table[:, np.newaxis, :, 0]).sum(axis=2) - 1
+            bands = table[np.arange(len(known))[:, np.newaxis], np.maximum(idx, 0)]
+            bp_low, bp_high, aqi_low, aqi_high = np.moveaxis(bands, -1, 0)
+            
+            # Values in the gaps between bands or above the table do not contribute
+            in_range = (idx >= 0) & (values <= bp_high)
+            aqi = (aqi_high - aqi_low) / (bp_high - bp_low) * (values - bp_low) + aqi_low
+            sub_index[known] = np.where(in_range, aqi, -np.inf)
+        
+        max_aqi = sub_index.max(axis=0, initial=0)
+        aqi = np.clip(max_aqi.astype(int), 0, 500)
         
-        return min(500, max(0, int(max_aqi)))
+        dominant = np.full(concentrations.shape[1], None, dtype=object)
+        if pollutants:
+            has_value = np.isfinite(sub_index).any(axis=0)
+            dominant[has_value] = np.array(pollutants, dtype=object)[sub_index.argmax(axis=0)][has_value]
+        return aqi, dominant
     
-    def save_models(self, path='ai_model/models'):
+    def save_models(self, path=DEFAULT_MODEL_DIR):
         """Save trained models"""
-        import os
+        import joblib
         os.makedirs(path, exist_ok=True)
         
         for target in self.models:
             joblib.dump(self.models[target], f'{path}/{target}_model.pkl')
             joblib.dump(self.scalers[target], f'{path}/{target}_scaler.pkl')
+            if target in self.running_scalers:
+                joblib.dump(self.running_scalers[target], f'{path}/{target}_running_scaler.pkl')
+        for target, model in self.direct_models.items():
+            joblib.dump({'horizons': self.direct_horizons, 'model': model}, f'{path}/{target}{DIRECT_SUFFIX}_model.pkl')
+        if self.selection_results:
+            with open(f'{path}/selection.json', 'w') as f:
+                json.dump(self.selection_results, f, indent=2)
         
         print(f"Models saved to {path}")
     
-    def load_models(self, path='ai_model/models'):
+    def load_models(self, path=DEFAULT_MODEL_DIR):
         """Load trained models"""
-        import os
+        import joblib
         
+        self.model_features = []
         for target in self.target_columns:
             model_path = f'{path}/{target}_model.pkl'
             scaler_path = f'{path}/{target}_scaler.pkl'
@@ -287,22 +937,172 @@ class AirQualityForecaster:
                 self.models[target] = joblib.load(model_path)
                 self.scalers[target] = joblib.load(scaler_path)
         
+        self.running_scalers = {}
+        for target in self.models:
+            running_path = f'{path}/{target}_running_scaler.pkl'
+            if os.path.exists(running_path):
+                self.running_scalers[target] = joblib.load(running_path)
+        
+        self.direct_models = {}
+        for target in self.models:
+            direct_path = f'{path}/{target}{DIRECT_SUFFIX}_model.pkl'
+            if os.path.exists(direct_path):
+                direct = joblib.load(direct_path)
+                self.direct_models[target] = direct['model']
+                self.direct_horizons = tuple(direct['horizons'])
+        
+        self.compile_models()
         print(f"Models loaded from {path}")
+    
+    def compile_models(self, X_check=None, tolerance=1e-6):
+        """Export each tree ensemble to flat node arrays, keeping only exports that match sklearn"""
+        self.compiled_models = self._compile(self.models, X_check, tolerance)
+        self.compiled_direct_models = self._compile(self.direct_models, X_check, tolerance)
+    
+    def _compile(self, models, X_check, tolerance):
+        compiled_models = {}
+        if not COMPILED_INFERENCE:
+            return compiled_models
+        
+        for target, model in models.items():
+            if isinstance(model, FlatEnsemble):
+                compiled_models[target] = model
+                continue
+            
+            try:
+                compiled = FlatEnsemble.from_sklearn(model)
+            except ValueError as e:
+                print(f"{target}: using sklearn inference ({e})")
+                continue
+            
+            # Without held-out rows, check on random points in the scaled feature space
+            X = X_check
+            if X is None:
+                X = np.random.default_rng(0).normal(0, 2, (256, model.n_features_in_))
+            error = np.max(np.abs(compiled.predict(X) - model.predict(X)))
+            if error > tolerance:
+                print(f"{target}: compiled model differs from sklearn by {error:.3g}, using sklearn inference")
+                continue
+            compiled_models[target] = compiled
+        return compiled_models
+    
+    def _predictor(self, target, n_rows, direct=False):
+        """Pick the compiled or sklearn model for a batch of n_rows"""
+        model = (self.direct_models if direct else self.models)[target]
+        compiled = (self.compiled_direct_models if direct else self.compiled_models).get(target)
+        if compiled is not None and (n_rows <= COMPILED_MAX_ROWS or isinstance(model, FlatEnsemble)):
+            return compiled
+        return model
+    
+    def save_bundle(self, path=DEFAULT_MODEL_DIR):
+        """Save all models, scalers and feature columns as one memory-mappable bundle"""
+        os.makedirs(path, exist_ok=True)
+        write_bundle(f'{path}/{BUNDLE_FILENAME}', self.models, self.scalers,
+                     self.get_model_features(), self.model_version)
+        if self.direct_models:
+            write_bundle(f'{path}/{DIRECT_BUNDLE_FILENAME}', self.direct_models, self.scalers,
+                         self.get_model_features(), self.model_version, horizons=self.direct_horizons)
+        
+        print(f"Model bundle saved to {path}/{BUNDLE_FILENAME}")
+    
+    def load_bundle(self, path=DEFAULT_MODEL_DIR, use_mmap=True):
+        """Load models from a bundle, sharing the tree arrays through a file mapping"""
+        models, scalers, header = read_bundle(f'{path}/{BUNDLE_FILENAME}', use_mmap=use_mmap)
+        self.models = models
+        self.scalers = scalers
+        self.running_scalers = {}
+        self.model_features = header['feature_columns']
+        self.compiled_models = dict(models)
+        
+        self.direct_models = {}
+        if os.path.exists(f'{path}/{DIRECT_BUNDLE_FILENAME}'):
+            direct_models, _, header = read_bundle(f'{path}/{DIRECT_BUNDLE_FILENAME}', use_mmap=use_mmap)
+            self.direct_models = direct_models
+            self.direct_horizons = tuple(header['horizons'])
+        self.compiled_direct_models = dict(self.direct_models)
+        
+        print(f"Model bundle loaded from {path}/{BUNDLE_FILENAME}")
+    
+    def save_model_version(self, base_path=DEFAULT_MODEL_DIR, version=None, keep=MODEL_KEEP_VERSIONS, protect=()):
+        """Save trained models to a new versioned directory, mark it as the latest and prune old versions.
+        
+        Beyond the newest keep versions, old versions are removed unless they
+        are named in protect, such as the version a server is still serving.
+        """
+        version = version or datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        self.model_version = version
+        self.save_models(f'{base_path}/{version}')
+        self.save_bundle(f'{base_path}/{version}')
+        
+        # Point LATEST at the new version with an atomic rename
+        tmp_path = f'{base_path}/LATEST.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, f'{base_path}/LATEST')
+        prune_model_versions(base_path, keep, protect)
+        
+        return version
+    
+    def load_latest_models(self, base_path=DEFAULT_MODEL_DIR, prefer_bundle=True):
+        """Load the latest versioned models, falling back to unversioned models in base_path"""
+        version = read_latest_version(base_path)
+        path = base_path if version is None else f'{base_path}/{version}'
+        
+        # Prefer the shared bundle; pickles remain for tools that need the sklearn estimators,
+        # such as incremental updates
+        with time_stage('model_load'):
+            if prefer_bundle and os.path.exists(f'{path}/{BUNDLE_FILENAME}'):
+                self.load_bundle(path)
+            else:
+                self.load_models(path)
+        self.model_version = version
+        return version
 
 if __name__ == "__main__":
+    import argparse
+    from training_data import iter_training_chunks
+    
+    parser = argparse.ArgumentParser(description="Train air quality forecasting models")
+    parser.add_argument('--data', help="CSV, Parquet or NDJSON file, or a directory of them; synthetic data if omitted")
+    parser.add_argument('--format', choices=('csv', 'parquet', 'ndjson'), help="Data format if not clear from the extension")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows read per chunk")
+    parser.add_argument('--n-samples', type=int, default=8760, help="Hours of synthetic data to generate")
+    parser.add_argument('--n-workers', type=int, help="Training processes (default: CPU count)")
+    parser.add_argument('--model-dir', default=DEFAULT_MODEL_DIR, help="Directory to save the model version in")
+    parser.add_argument('--update', action='store_true',
+                        help="Incrementally update the latest model version with --data instead of retraining")
+    parser.add_argument('--trees', type=int, default=INCREMENTAL_TREES, help="Trees added per model by --update")
+    parser.add_argument('--direct', action='store_true', help="Also train direct multi-horizon models")
+    parser.add_argument('--select', action='store_true',
+                        help="Choose each model's configuration by time-series cross-validation over a search grid")
+    parser.add_argument('--grid', help="Search grid for --select as a JSON file or string (default: built-in grid)")
+    args = parser.parse_args()
+    if args.update and not args.data:
+        parser.error("--update needs --data with the new samples")
+    
     # Initialize forecaster
     forecaster = AirQualityForecaster()
     
-    # Generate training data
-    print("Generating synthetic training data...")
-    df = forecaster.generate_synthetic_data(n_samples=8760)  # 1 year of hourly data
+    # Read training data in chunks, or generate it
+    if args.data:
+        print(f"Reading training data from {args.data}...")
+        training_data = iter_training_chunks(args.data, args.chunk_size, args.format)
+    else:
+        print("Generating synthetic training data...")
+        training_data = forecaster.iter_synthetic_data(args.n_samples, chunk_size=args.chunk_size)
     
-    # Train models
-    print("Training forecasting models...")
-    forecaster.train_models(df)
+    if args.update:
+        print("Updating the latest models with the new samples...")
+        forecaster.load_latest_models(args.model_dir, prefer_bundle=False)
+        forecaster.update_models(training_data, n_trees=args.trees, n_workers=args.n_workers)
+    else:
+        # Train models
+        print("Training forecasting models...")
+        forecaster.train_models(training_data, n_workers=args.n_workers, direct=args.direct, select=args.select,
+                                grid=args.grid)
     
     # Save models
-    forecaster.save_models()
+    forecaster.save_model_version(args.model_dir)
     
     # Test prediction
     current_conditions = {
@@ -0,0 +1,30 @@
+import os
+import threading
+
+class BackgroundThread:
+    """A daemon thread started on first use, and started again in each forked process.
+    
+    Threads do not survive a fork, so a gunicorn worker forked from a
+    preloaded app has none running even if the master started one. reset is
+    called before every start to give the new thread fresh per-process state,
+    such as a queue that no thread in this process would drain.
+    """
+    
+    def __init__(self, target, name, reset=None):
+        self.target = target
+        self.name = name
+        self.reset = reset
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+    
+    def ensure_started(self):
+        """Start the thread unless it is already running in this process"""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self.reset is not None:
+                self.reset()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.target, daemon=True, name=self.name)
+            self._thread.start()
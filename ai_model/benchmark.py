@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from air_quality_forecaster import AirQualityForecaster
+
+# Metrics compared against a baseline; every other value is reported only
+LOWER_IS_BETTER = ('median_ms', 'p99_ms', 'seconds')
+HIGHER_IS_BETTER = ('requests_per_second',)
+
+def measure(fn, repeats=5, number=1):
+    """Time repeats rounds of number calls to fn and summarize the time per call in milliseconds"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) * 1000 / number)
+    times.sort()
+    return {'median_ms': times[len(times) // 2], 'min_ms': times[0], 'repeats': repeats, 'number': number}
+
+def random_conditions(forecaster, n, seed=0):
+    """Current conditions for n locations, like the ones clients send to /forecast"""
+    rng = np.random.default_rng(seed)
+    return [{
+        'temperature': float(rng.uniform(0, 35)),
+        'humidity': float(rng.uniform(20, 90)),
+        'wind_speed': float(rng.uniform(0, 15)),
+        'pressure': float(rng.uniform(990, 1030)),
+        'hour': int(rng.integers(0, 24)),
+        **{target: float(rng.uniform(5, 80)) for target in forecaster.target_columns}
+    } for _ in range(n)]
+
+def bench_data(results, sizes, repeats):
+    """Synthetic data generation and feature preparation at each dataset size"""
+    forecaster = AirQualityForecaster()
+    for rows in sizes:
+        results[f'generate_synthetic_data/rows={rows}'] = measure(
+            lambda: forecaster.generate_synthetic_data(rows), repeats)
+        df = forecaster.generate_synthetic_data(rows)
+        results[f'prepare_features/rows={rows}'] = measure(lambda: forecaster.prepare_features(df.copy()), repeats)
+
+def bench_training(results, sizes, n_workers):
+    """One full training run per dataset size; returns the model trained on the largest"""
+    forecaster = None
+    for rows in sizes:
+        forecaster = AirQualityForecaster()
+        data = forecaster.generate_synthetic_data(rows)
+        start = time.perf_counter()
+        forecaster.train_models(data, n_workers=n_workers)
+        results[f'train_models/rows={rows}'] = {
+            'seconds': time.perf_counter() - start,
+            'stages': {stage: seconds for stage, seconds in forecaster.training_stats.items()
+                       if isinstance(seconds, float)}
+        }
+    return forecaster
+
+def bench_inference(results, forecaster, horizons, batch_size, repeats):
+    """Single and batched forecasts at each horizon, and AQI calculation"""
+    conditions = random_conditions(forecaster, batch_size)
+    for hours in horizons:
+        results[f'predict_forecast/hours={hours}'] = measure(
+            lambda: forecaster.predict_forecast(conditions[0], hours), repeats)
+        results[f'predict_forecast_batch/locations={batch_size},hours={hours}'] = measure(
+            lambda: forecaster.predict_forecast_batch(conditions, hours), repeats)
+    
+    pollutants = {target: conditions[0][target] for target in forecaster.target_columns}
+    results['calculate_aqi'] = measure(lambda: forecaster.calculate_aqi(pollutants), repeats, number=1000)
+    concentrations = np.array([[location[target] for location in conditions] for target in forecaster.target_columns])
+    results[f'calculate_aqi_batch/locations={batch_size}'] = measure(
+        lambda: forecaster.calculate_aqi_batch(concentrations, forecaster.target_columns), repeats, number=1000)
+
+def bench_persistence(results, forecaster, model_dir, repeats):
+    """Saving and loading the pickled estimators and the model bundle"""
+    path = os.path.join(model_dir, 'bench')
+    results['save_models'] = measure(lambda: forecaster.save_models(path), repeats)
+    results['load_models'] = measure(lambda: AirQualityForecaster().load_models(path), repeats)
+    results['save_bundle'] = measure(lambda: forecaster.save_bundle(path), repeats)
+    results['load_bundle'] = measure(lambda: AirQualityForecaster().load_bundle(path), repeats)
+
+def bench_api(results, forecaster, model_dir, horizons, concurrency_levels, requests_per_client):
+    """/forecast through Flask's test client, then over HTTP with the load generator"""
+    # forecast_api loads the latest version from MODEL_DIR on import; leave caching off so every
+    # request reaches the models
+    forecaster.save_model_version(model_dir)
+    os.environ['MODEL_DIR'] = model_dir
+    os.environ.setdefault('FORECAST_CACHE_SIZE', '0')
+    import forecast_api
+    from load_test import run_load
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+    
+    client = forecast_api.app.test_client()
+    for hours in horizons:
+        bodies = iter([dict(location, hours_ahead=hours)
+                       for location in random_conditions(forecaster, 1000, seed=hours)])
+        results[f'api_forecast/hours={hours}'] = measure(
+            lambda: client.post('/forecast', json=next(bodies)), min(1000, requests_per_client * 4))
+    
+    server = make_server('127.0.0.1', 0, forecast_api.app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for concurrency in concurrency_levels:
+            results[f'http_load/concurrency={concurrency}'] = run_load(
+                f'http://127.0.0.1:{server.server_port}', concurrency, requests_per_client)
+    finally:
+        server.shutdown()
+
+def run_benchmarks(sizes=(10000, 100000), train_sizes=(500, 2000), horizons=(1, 24, 72, 168), batch_size=64,
+                   concurrency_levels=(1, 4, 16), requests_per_client=25, repeats=5, n_workers=None,
+                   include=('data', 'training', 'inference', 'persistence', 'api')):
+    """Run the selected benchmark groups and return their results with environment details"""
+    import pandas
+    import sklearn
+    
+    results = {}
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='airsense-bench-') as model_dir:
+        if 'data' in include:
+            bench_data(results, sizes, repeats)
+        forecaster = None
+        if 'training' in include:
+            forecaster = bench_training(results, train_sizes, n_workers)
+        elif {'inference', 'persistence', 'api'} & set(include):
+            forecaster = AirQualityForecaster()
+            forecaster.train_models(forecaster.generate_synthetic_data(min(train_sizes)), n_workers=n_workers)
+        if 'inference' in include:
+            bench_inference(results, forecaster, horizons, batch_size, repeats)
+        if 'persistence' in include:
+            bench_persistence(results, forecaster, model_dir, repeats)
+        if 'api' in include:
+            bench_api(results, forecaster, model_dir, horizons, concurrency_levels, requests_per_client)
+    
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pandas.__version__,
+            'sklearn': sklearn.__version__,
+            'seconds': time.perf_counter() - started
+        },
+        'results': results
+    }
+
+def compare(current, baseline, threshold=0.25):
+    """Compare results with a baseline run; returns (regressions, improvements) as readable lines.
+    
+    A metric regresses when it is more than threshold (a fraction) worse than
+    the baseline. Benchmarks present in only one run are skipped.
+    """
+    regressions = []
+    improvements = []
+    for name, metrics in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old or value is None:
+                continue
+            if metric in LOWER_IS_BETTER:
+                change = value / old - 1
+            elif metric in HIGHER_IS_BETTER:
+                change = old / value - 1 if value else float('inf')
+            else:
+                continue
+            line = f"{name} {metric}: {old:.3f} -> {value:.3f} ({value / old - 1:+.1%})"
+            if change > threshold:
+                regressions.append(line)
+            elif change < -threshold:
+                improvements.append(line)
+    return regressions, improvements
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark training, inference, AQI, persistence and the forecast API")
+    parser.add_argument('--sizes', default='10000,100000', help="Dataset sizes (rows) for data generation and features")
+    parser.add_argument('--train-sizes', default='500,2000', help="Dataset sizes (rows) to train on")
+    parser.add_argument('--horizons', default='1,24,72,168', help="Forecast horizons in hours")
+    parser.add_argument('--batch-size', type=int, default=64, help="Locations per batched forecast")
+    parser.add_argument('--concurrency', default='1,4,16', help="Concurrent clients for the HTTP load test")
+    parser.add_argument('--requests', type=int, default=25, help="Requests per concurrent client")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--n-workers', type=int, help="Training processes (default: CPU count)")
+    parser.add_argument('--only', help="Comma-separated groups: data, training, inference, persistence, api")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier --output to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Slowdown that counts as a regression")
+    args = parser.parse_args()
+    
+    def numbers(spec):
+        return tuple(int(value) for value in spec.split(','))
+    
+    groups = tuple(args.only.split(',')) if args.only else ('data', 'training', 'inference', 'persistence', 'api')
+    report = run_benchmarks(numbers(args.sizes), numbers(args.train_sizes), numbers(args.horizons), args.batch_size,
+                            numbers(args.concurrency), args.requests, args.repeats, args.n_workers, groups)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions, improvements = compare(report, baseline, args.threshold)
+        for line in improvements:
+            print(f"faster: {line}")
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        print(f"{len(regressions)} regressions, {len(improvements)} improvements beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,258 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+
+# Lags and rolling windows in hours, as prepare_features builds them
+LAG_HOURS = (1, 24)
+ROLLING_WINDOWS = (3, 24)
+
+class StationHistory:
+    """Recent hourly pollutant readings of one station in a fixed-size ring buffer.
+    
+    Running sums per rolling window are updated as readings enter and leave
+    the window, so an ingest and a feature lookup cost O(1) in the history
+    length. Features match what prepare_features computes for the last row of
+    the station's hourly history.
+    """
+    
+    def __init__(self, n_targets):
+        self.capacity = max(max(LAG_HOURS) + 1, max(ROLLING_WINDOWS))
+        self.values = np.zeros((self.capacity, n_targets))
+        self.sums = np.zeros((len(ROLLING_WINDOWS), n_targets))
+        self.count = 0
+        self.hour = None
+        self.observed_at = None
+        self.conditions = {}
+    
+    def latest(self):
+        """The most recent readings, or None before the first one"""
+        return self.values[(self.count - 1) % self.capacity] if self.count else None
+    
+    def push(self, readings):
+        """Append the readings of the next hour"""
+        for i, window in enumerate(ROLLING_WINDOWS):
+            if self.count >= window:
+                self.sums[i] -= self.values[(self.count - window) % self.capacity]
+            self.sums[i] += readings
+        self.values[self.count % self.capacity] = readings
+        self.count += 1
+    
+    def replace_latest(self, readings):
+        """Overwrite the readings of the latest hour, e.g. with a corrected value"""
+        self.sums += readings - self.latest()
+        self.values[(self.count - 1) % self.capacity] = readings
+    
+    def lag(self, hours):
+        """Readings from the given number of hours before the latest; 0 where there is no history"""
+        if self.count <= hours:
+            return np.zeros(self.values.shape[1])
+        return self.values[(self.count - 1 - hours) % self.capacity]
+    
+    def rolling_mean(self, i):
+        """Mean over the i-th rolling window, using the readings available so far"""
+        return self.sums[i] / min(self.count, ROLLING_WINDOWS[i])
+    
+    def to_dict(self):
+        """JSON-serializable state"""
+        return {
+            'values': self.values.tolist(),
+            'sums': self.sums.tolist(),
+            'count': self.count,
+            'hour': self.hour,
+            'observed_at': self.observed_at.isoformat() if self.observed_at else None,
+            'conditions': self.conditions
+        }
+    
+    @classmethod
+    def from_dict(cls, state):
+        """Restore a history saved with to_dict"""
+        values = np.array(state['values'], dtype=float)
+        station = cls(values.shape[1])
+        station.values = values
+        station.sums = np.array(state['sums'], dtype=float)
+        station.count = state['count']
+        station.hour = state['hour']
+        station.observed_at = datetime.fromisoformat(state['observed_at']) if state['observed_at'] else None
+        station.conditions = state['conditions']
+        return station
+
+class FeatureStore:
+    """Per-station history of hourly observations, serving model features without a full history.
+    
+    With a path, each station's history is kept in its own small file there,
+    locked while it is read or updated, so every server process on the host
+    sees the same stations. Without one, histories live in this process only.
+    """
+    
+    def __init__(self, target_columns, feature_columns, max_stations=10000, path=None):
+        self.target_columns = list(target_columns)
+        self.feature_columns = list(feature_columns)
+        self.max_stations = max_stations
+        self.path = path
+        self._stations = OrderedDict()
+        self._lock = threading.RLock()
+        self.observations = 0
+        self.evictions = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+    
+    @classmethod
+    def from_env(cls, target_columns, feature_columns):
+        """Create a store configured from FEATURE_STORE_* environment variables.
+        
+        Histories are shared through FEATURE_STORE_DIR (default
+        MODEL_DIR/stations); set it empty to keep them in each process.
+        """
+        path = os.environ.get('FEATURE_STORE_DIR', os.path.join(os.environ.get('MODEL_DIR', 'models'), 'stations'))
+        return cls(target_columns, feature_columns,
+                   max_stations=int(os.environ.get('FEATURE_STORE_MAX_STATIONS', 10000)), path=path or None)
+    
+    def _station_path(self, station_id):
+        # Hashed, so any station ID makes a safe file name
+        return os.path.join(self.path, hashlib.blake2b(station_id.encode(), digest_size=16).hexdigest() + '.json')
+    
+    @contextmanager
+    def _station(self, station_id, create=False):
+        """The history of a station, or None if it has none and create is false, held locked.
+        
+        Changes made to it are saved when the block exits without an error.
+        """
+        if not self.path:
+            with self._lock:
+                station = self._stations.get(station_id)
+                if station is None and create:
+                    station = StationHistory(len(self.target_columns))
+                    self._stations[station_id] = station
+                    while len(self._stations) > self.max_stations:
+                        self._stations.popitem(last=False)
+                        self.evictions += 1
+                if station is not None:
+                    self._stations.move_to_end(station_id)
+                yield station
+            return
+        
+        path = self._station_path(station_id)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT if create else os.O_RDONLY)
+        except FileNotFoundError:
+            yield None
+            return
+        with os.fdopen(fd, 'r+' if create else 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if create else fcntl.LOCK_SH)
+            content = f.read()
+            # An empty file is a station being created, or one whose first observation was rejected
+            station = StationHistory.from_dict(json.loads(content)) if content else None
+            if station is None and create:
+                station = StationHistory(len(self.target_columns))
+                self._evict_files(keep=path)
+            yield station
+            if create:
+                # Rewritten in place: readers hold a shared lock, so they never see a partial write
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(station.to_dict()))
+    
+    def _evict_files(self, keep):
+        """Remove the least recently updated station files beyond max_stations"""
+        entries = [entry for entry in os.scandir(self.path) if entry.name.endswith('.json') and entry.path != keep]
+        excess = len(entries) + 1 - self.max_stations
+        if excess <= 0:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:excess]:
+            try:
+                os.remove(entry.path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+    
+    def ingest(self, station_id, observation):
+        """Add one hourly observation for a station and return its updated features.
+        
+        Readings in the same hour as the latest one replace it; hours skipped
+        since the latest one are filled with its readings, like the forward
+        fill used in training. Missing pollutants carry their last reading.
+        Timestamps with a UTC offset are ordered by the instant they denote;
+        naive ones, and observations without a timestamp, are in server local time.
+        """
+        observed_at = observation.get('timestamp')
+        observed_at = datetime.fromisoformat(observed_at) if observed_at else datetime.now()
+        # astimezone takes a naive time as local time and converts an aware one by its offset
+        hour = int(observed_at.astimezone(timezone.utc).timestamp() // 3600)
+        
+        with self._station(str(station_id), create=True) as station:
+            if station.hour is not None and hour < station.hour:
+                raise ValueError(f"Observation at {observed_at.isoformat()} is older than the latest one "
+                                 f"for station {station_id} ({station.observed_at.isoformat()})")
+            
+            previous = station.latest()
+            readings = np.array([
+                observation[target] if observation.get(target) is not None
+                else (previous[i] if previous is not None else 0.0)
+                for i, target in enumerate(self.target_columns)
+            ], dtype=float)
+            
+            if station.hour == hour:
+                station.replace_latest(readings)
+            else:
+                if station.hour is not None:
+                    for _ in range(min(hour - station.hour - 1, station.capacity)):
+                        station.push(previous)
+                station.push(readings)
+            
+            station.hour = hour
+            station.observed_at = observed_at
+            station.conditions.update({col: float(observation[col]) for col in self.feature_columns
+                                       if observation.get(col) is not None})
+            station.conditions.update({
+                'hour': observed_at.hour,
+                'day_of_week': observed_at.weekday(),
+                'month': observed_at.month,
+                'season': (observed_at.month - 1) // 3
+            })
+            with self._lock:
+                self.observations += 1
+            return self._features(station)
+    
+    def features(self, station_id):
+        """Current model features of a station, or None if it has no observations"""
+        with self._station(str(station_id)) as station:
+            return self._features(station) if station is not None and station.count else None
+    
+    def observed_at(self, station_id):
+        """Time of a station's latest observation, or None"""
+        with self._station(str(station_id)) as station:
+            return station.observed_at if station is not None and station.count else None
+    
+    def _features(self, station):
+        features = dict(station.conditions)
+        lags = {hours: station.lag(hours) for hours in LAG_HOURS}
+        means = [station.rolling_mean(i) for i in range(len(ROLLING_WINDOWS))]
+        latest = station.latest()
+        for j, target in enumerate(self.target_columns):
+            features[target] = float(latest[j])
+            for hours in LAG_HOURS:
+                features[f'{target}_lag{hours}'] = float(lags[hours][j])
+            for i, window in enumerate(ROLLING_WINDOWS):
+                features[f'{target}_rolling_{window}h'] = float(means[i][j])
+        return features
+    
+    def stats(self):
+        """Station and observation counters"""
+        stations = len(self._stations)
+        if self.path:
+            stations = sum(entry.name.endswith('.json') and entry.stat().st_size > 0 for entry in os.scandir(self.path))
+        with self._lock:
+            return {
+                'stations': stations,
+                'shared': bool(self.path),
+                'max_stations': self.max_stations,
+                'observations': self.observations,
+                'evictions': self.evictions
+            }
@@ -1,205 +1,932 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+import io
 import json
 from datetime import datetime, timedelta
 import numpy as np
-from air_quality_forecaster import AirQualityForecaster
+from air_quality_forecaster import AirQualityForecaster, INCREMENTAL_TREES, read_latest_version
+from feature_store import FeatureStore
+from forecast_cache import ForecastCache
+from forecast_scheduler import ForecastScheduler
+from forecast_stream import STREAM_FORMATS, make_encoder, stream_format
+from metrics import registry, time_stage
+from micro_batcher import MicroBatcher
+from model_selection import load_grid
+from training_data import DEFAULT_CHUNK_SIZE, iter_training_chunks
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 CORS(app)
 
-# Initialize forecaster
+# Initialize forecaster. Loaded model sets are never mutated: a retrain builds
+# a new forecaster and swaps it in, so a request sees one consistent version.
 forecaster = AirQualityForecaster()
+swap_lock = threading.Lock()
 
-# Load pre-trained models if they exist
-if os.path.exists('models'):
+MODEL_DIR = os.environ.get('MODEL_DIR', 'models')
+
+# Serving readiness, reported separately from liveness
+model_state = {
+    'ready': False,
+    'error': None,
+    'model_version': None,
+    'loaded_at': None,
+    'load_seconds': None
+}
+
+# Forecasts for recently seen (quantized) conditions
+forecast_cache = ForecastCache.from_env()
+
+# Optional micro-batching of concurrent forecast requests
+micro_batcher = MicroBatcher.from_env()
+
+# Recent observations per station, so forecasts can use real lag and rolling features
+feature_store = FeatureStore.from_env(forecaster.target_columns, forecaster.feature_columns)
+
+# Precomputed forecasts of registered locations, refreshed hourly and on new station data
+forecast_scheduler = ForecastScheduler.from_env(lambda specs: precompute_forecasts(specs))
+
+# Background training jobs by job ID; trained one at a time
+training_jobs = {}
+training_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='training')
+MAX_TRAINING_JOBS = 100
+
+# Streamed /train uploads by content type; when TRAINING_DATA_DIR is set, data_path must be inside it
+UPLOAD_FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv'
+}
+TRAINING_DATA_DIR = os.environ.get('TRAINING_DATA_DIR')
+
+# How often each worker checks MODEL_DIR/LATEST for versions published by other processes
+MODEL_POLL_SECONDS = float(os.environ.get('MODEL_POLL_SECONDS', 30))
+refresh_lock = threading.Lock()
+last_model_check = [time.monotonic()]
+
+MAX_BATCH_LOCATIONS = int(os.environ.get('FORECAST_BATCH_MAX_LOCATIONS', 1000))
+
+# Longest horizon /forecast, /forecast/batch and /locations accept; longer ones can be streamed
+MAX_FORECAST_HOURS = int(os.environ.get('FORECAST_MAX_HOURS', 720))
+
+# Longest horizon /forecast/stream accepts, and the hours computed per streamed block by default
+MAX_STREAM_HOURS = int(os.environ.get('FORECAST_STREAM_MAX_HOURS', 8760))
+STREAM_BLOCK_HOURS = int(os.environ.get('FORECAST_STREAM_BLOCK_HOURS', 24))
+
+# Per-request cProfile summaries with ?profile=1, only when enabled; one request is profiled at a time
+PROFILING_ENABLED = os.environ.get('FORECAST_PROFILING', '0') == '1'
+PROFILE_TOP_N = int(os.environ.get('FORECAST_PROFILE_TOP_N', 25))
+profile_lock = threading.Lock()
+
+registry.counter('airsense_requests_total', "HTTP requests by endpoint, method and status")
+registry.histogram('airsense_request_duration_seconds', "HTTP request latency by endpoint")
+registry.counter('airsense_training_jobs_total', "Finished training jobs by status")
+registry.gauge('airsense_model_info', "Model version being served")
+registry.gauge('airsense_model_ready', "Whether models are loaded and serving")
+registry.gauge('airsense_model_age_seconds', "Time since the served model version was trained")
+registry.gauge('airsense_model_load_seconds', "Time the served model version took to load")
+registry.counter('airsense_forecast_cache_hits_total', "Forecast cache hits")
+registry.counter('airsense_forecast_cache_misses_total', "Forecast cache misses")
+registry.gauge('airsense_forecast_cache_entries', "Forecasts in the cache")
+registry.counter('airsense_microbatch_batches_total', "Micro-batches predicted")
+registry.counter('airsense_microbatch_requests_total', "Forecasts predicted through the micro-batcher")
+registry.gauge('airsense_feature_store_stations', "Stations in the feature store")
+registry.gauge('airsense_precompute_locations', "Locations registered for precomputed forecasts")
+registry.counter('airsense_precompute_refreshes_total', "Batched recomputations of registered locations")
+registry.gauge('airsense_precompute_last_refresh_seconds', "Duration of the latest batched recomputation")
+registry.counter('airsense_feature_store_observations_total', "Observations ingested into the feature store")
+
+def activate_forecaster(new_forecaster, load_seconds=None):
+    """Atomically make a fully loaded model set the one used for serving"""
+    global forecaster
+    with swap_lock:
+        forecaster = new_forecaster
+        forecast_cache.invalidate()
+        forecast_scheduler.refresh_all()
+        model_state.update(ready=True, error=None, model_version=new_forecaster.model_version,
+                           loaded_at=datetime.now().isoformat(), load_seconds=load_seconds)
+
+def load_serving_models():
+    """Load pre-trained models for serving; never trains inline"""
+    start = time.perf_counter()
+    loaded = AirQualityForecaster()
     try:
-        forecaster.load_models()
-        print("Pre-trained models loaded successfully")
+        loaded.load_latest_models(MODEL_DIR)
     except Exception as e:
-        print(f"Error loading models: {e}")
-        print("Training new models...")
-        # Generate and train on synthetic data
-        df = forecaster.generate_synthetic_data(n_samples=8760)
-        forecaster.train_models(df)
-        forecaster.save_models()
+        model_state['error'] = f"Error loading models: {e}"
+        print(model_state['error'])
+        return
+    
+    if not loaded.models:
+        model_state['error'] = f"No pre-trained models found in {MODEL_DIR}. Run air_quality_forecaster.py or POST /train."
+        print(model_state['error'])
+        return
+    
+    activate_forecaster(loaded, load_seconds=round(time.perf_counter() - start, 3))
+    print(f"Pre-trained models loaded successfully in {model_state['load_seconds']}s")
+
+def refresh_models():
+    """Swap in the latest published model version if it is newer than the one being served"""
+    if not refresh_lock.acquire(blocking=False):
+        return False
+    try:
+        latest = read_latest_version(MODEL_DIR)
+        if latest is None or latest == model_state['model_version']:
+            return False
+        load_serving_models()
+        return model_state['model_version'] == latest
+    finally:
+        refresh_lock.release()
+
+def load_registered_locations(path):
+    """Register the locations listed in a JSON file of /forecast bodies with location_id"""
+    with open(path) as f:
+        specs = json.load(f)
+    forecast_scheduler.register_many({spec['location_id']: spec for spec in specs})
+    print(f"Registered {len(specs)} locations for precomputed forecasts from {path}")
+
+if os.environ.get('FORECAST_LOCATIONS_FILE'):
+    load_registered_locations(os.environ['FORECAST_LOCATIONS_FILE'])
+
+# Load artifacts now, or in the background so the process is live immediately
+if os.environ.get('MODEL_LOAD_MODE', 'sync') == 'background':
+    threading.Thread(target=load_serving_models, daemon=True).start()
 else:
-    print("No pre-trained models found. Training new models...")
-    # Generate and train on synthetic data
-    df = forecaster.generate_synthetic_data(n_samples=8760)
-    forecaster.train_models(df)
-    forecaster.save_models()
+    load_serving_models()
+
+def collect_metrics():
+    """Model, cache, micro-batching and feature store values for /metrics"""
+    version = model_state['model_version']
+    try:
+        age = time.time() - datetime.strptime(version, '%Y%m%d-%H%M%S-%f').timestamp()
+    except (TypeError, ValueError):
+        age = None
+    cache = forecast_cache.stats()
+    batching = micro_batcher.stats()
+    stations = feature_store.stats()
+    precompute = forecast_scheduler.stats()
+    return [
+        ('airsense_model_info', {'version': version or ''}, 1),
+        ('airsense_model_ready', {}, int(model_state['ready'])),
+        ('airsense_model_age_seconds', {}, age),
+        ('airsense_model_load_seconds', {}, model_state['load_seconds']),
+        ('airsense_forecast_cache_hits_total', {}, cache['hits']),
+        ('airsense_forecast_cache_misses_total', {}, cache['misses']),
+        ('airsense_forecast_cache_entries', {}, cache['size']),
+        ('airsense_microbatch_batches_total', {}, batching['batches']),
+        ('airsense_microbatch_requests_total', {}, batching['requests']),
+        ('airsense_feature_store_stations', {}, stations['stations']),
+        ('airsense_feature_store_observations_total', {}, stations['observations']),
+        ('airsense_precompute_locations', {}, precompute['locations']),
+        ('airsense_precompute_refreshes_total', {}, precompute['refreshes']),
+        ('airsense_precompute_last_refresh_seconds', {}, precompute['last_refresh_seconds'])
+    ]
+
+registry.add_collector(collect_metrics)
+
+@app.before_request
+def start_request_timer():
+    """Time every request, and profile it when asked to and profiling is enabled"""
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if PROFILING_ENABLED and request.args.get('profile') in ('1', 'true') and profile_lock.acquire(blocking=False):
+        import cProfile
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request(response):
+    """Count the request, record its latency and attach a requested profile summary"""
+    if g.get('profiler') is not None:
+        g.profiler.disable()
+        profile_lock.release()
+        if response.is_json and isinstance(response.get_json(silent=True), dict):
+            import pstats
+            summary = io.StringIO()
+            pstats.Stats(g.profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+            body = response.get_json()
+            body['profile'] = summary.getvalue()
+            response.set_data(json.dumps(body))
+    
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    registry.inc('airsense_requests_total', endpoint=endpoint, method=request.method, status=str(response.status_code))
+    if 'request_start' in g:
+        registry.observe('airsense_request_duration_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.before_request
+def check_model_version():
+    """Periodically pick up model versions trained by other worker processes"""
+    now = time.monotonic()
+    if MODEL_POLL_SECONDS <= 0 or now - last_model_check[0] < MODEL_POLL_SECONDS:
+        return
+    last_model_check[0] = now
+    threading.Thread(target=refresh_models, daemon=True).start()
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness check endpoint: 200 once models are loaded"""
+    status = {
+        "ready": model_state['ready'],
+        "models": sorted(forecaster.models),
+        "model_version": model_state['model_version'],
+        "loaded_at": model_state['loaded_at'],
+        "load_seconds": model_state['load_seconds'],
+        "timestamp": datetime.now().isoformat()
+    }
+    if not model_state['ready']:
+        status["error"] = model_state['error'] or "Models are loading"
+        return jsonify(status), 503
+    return jsonify(status)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request, stage latency, model and cache metrics in the Prometheus text format"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/forecast', methods=['POST'])
 def get_forecast():
     """Generate air quality forecast"""
+    if not model_state['ready']:
+        return jsonify({"error": model_state['error'] or "Models are loading"}), 503
+    
     try:
         data = request.get_json()
+        if not isinstance(data, dict):
+            return jsonify({"error": "The request body must be a JSON object"}), 400
+        hours_ahead = data.get('hours_ahead', 24)
+        if not valid_hours_ahead(hours_ahead):
+            return jsonify({"error": f"'hours_ahead' must be an integer between 0 and {MAX_FORECAST_HOURS}"}), 400
+        precomputed = precomputed_forecast(data)
+        if precomputed is not None:
+            return precomputed
         
-        # Extract current conditions
-        current_conditions = {
-            'temperature': data.get('temperature', 20),
-            'humidity': data.get('humidity', 60),
-            'wind_speed': data.get('wind_speed', 5),
-            'pressure': data.get('pressure', 1013),
-            'hour': data.get('hour', datetime.now().hour),
-            'day_of_week': data.get('day_of_week', datetime.now().weekday()),
-            'month': data.get('month', datetime.now().month),
-            'season': data.get('season', (datetime.now().month - 1) // 3)
-        }
+        with time_stage('conditions'):
+            current_conditions = extract_conditions(data)
         
-        hours_ahead = data.get('hours_ahead', 24)
+        # Generate forecast from one model set, even if a retrain swaps in a new one meanwhile
+        active = forecaster
+        with time_stage('forecast'):
+            forecasts = cached_forecasts(active, [current_conditions], [hours_ahead])[0]
         
-        # Generate forecast
-        forecasts = forecaster.predict_forecast(current_conditions, hours_ahead)
-        
-        # Format response
-        response = {
-            'timestamp': datetime.now().isoformat(),
-            'location': data.get('location', 'Unknown'),
-            'current_conditions': current_conditions,
-            'forecasts': {},
-            'hourly_aqi': [],
-            'daily_summary': []
-        }
+        with time_stage('response'):
+            response = build_forecast_response(active, data, current_conditions, hours_ahead, forecasts)
+        with time_stage('serialize'):
+            return jsonify(response)
+    
+    except UnknownStationError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/forecast/batch', methods=['POST'])
+def get_forecast_batch():
+    """Generate air quality forecasts for many locations in one batched prediction"""
+    if not model_state['ready']:
+        return jsonify({"error": model_state['error'] or "Models are loading"}), 503
+    
+    try:
+        data = request.get_json() or {}
+        locations = data.get('locations')
+        if not isinstance(locations, list) or not locations:
+            return jsonify({"error": "'locations' must be a non-empty list"}), 400
+        if len(locations) > MAX_BATCH_LOCATIONS:
+            return jsonify({"error": f"At most {MAX_BATCH_LOCATIONS} locations per batch"}), 400
+        if not all(isinstance(location, dict) for location in locations):
+            return jsonify({"error": "Every location must be an object"}), 400
         
-        # Process forecasts
-        for pollutant, predictions in forecasts.items():
-            response['forecasts'][pollutant] = predictions
+        # Per-location horizons fall back to the batch-wide one
+        default_hours = data.get('hours_ahead', 24)
+        horizons = [location.get('hours_ahead', default_hours) for location in locations]
+        if not all(valid_hours_ahead(hours_ahead) for hours_ahead in horizons):
+            return jsonify({"error": f"'hours_ahead' must be an integer between 0 and {MAX_FORECAST_HOURS}"}), 400
+        with time_stage('conditions'):
+            conditions = [extract_conditions(location) for location in locations]
         
-        # Calculate hourly AQI
-        for hour in range(min(hours_ahead, 24)):
-            pollutant_values = {}
-            for pollutant in forecasts:
-                if hour < len(forecasts[pollutant]):
-                    pollutant_values[pollutant] = forecasts[pollutant][hour]
-            
-            aqi = forecaster.calculate_aqi(pollutant_values)
-            
-            forecast_time = datetime.now() + timedelta(hours=hour)
-            response['hourly_aqi'].append({
-                'hour': hour,
-                'time': forecast_time.isoformat(),
-                'aqi': aqi,
-                'level': get_aqi_level(aqi),
-                'pollutants': pollutant_values
-            })
-        
-        # Generate daily summary (next 3 days)
-        for day in range(3):
-            start_hour = day * 24
-            end_hour = min((day + 1) * 24, hours_ahead)
-            
-            if start_hour >= hours_ahead:
-                break
-            
-            daily_aqi_values = []
-            daily_pollutants = {pollutant: [] for pollutant in forecasts}
-            
-            for hour in range(start_hour, end_hour):
-                pollutant_values = {}
-                for pollutant in forecasts:
-                    if hour < len(forecasts[pollutant]):
-                        value = forecasts[pollutant][hour]
-                        pollutant_values[pollutant] = value
-                        daily_pollutants[pollutant].append(value)
-                
-                if pollutant_values:
-                    aqi = forecaster.calculate_aqi(pollutant_values)
-                    daily_aqi_values.append(aqi)
+        active = forecaster
+        with time_stage('forecast'):
+            forecasts = cached_forecasts(active, conditions, horizons)
+        
+        with time_stage('response'):
+            response = {
+                'timestamp': datetime.now().isoformat(),
+                'model_version': active.model_version,
+                'forecasts': [
+                    build_forecast_response(active, location, location_conditions, hours_ahead, location_forecasts)
+                    for location, location_conditions, hours_ahead, location_forecasts
+                    in zip(locations, conditions, horizons, forecasts)
+                ]
+            }
+        with time_stage('serialize'):
+            return jsonify(response)
+    
+    except UnknownStationError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/forecast/stream', methods=['POST'])
+def stream_forecast():
+    """Stream a forecast hour by hour as NDJSON, server-sent events or compact binary frames.
+    
+    Takes a /forecast body plus optional 'format' (ndjson, sse or binary;
+    otherwise from the Accept header) and 'block_hours'. Any horizon up to
+    FORECAST_STREAM_MAX_HOURS is streamed with AQI for every hour and a
+    summary after every day, and each block is sent as soon as it is computed.
+    """
+    if not model_state['ready']:
+        return jsonify({"error": model_state['error'] or "Models are loading"}), 503
+    
+    try:
+        data = request.get_json() or {}
+        format_name = stream_format(data.get('format') or request.args.get('format'), request.headers.get('Accept'))
+        hours_ahead = int(data.get('hours_ahead', 24))
+        block_hours = int(data.get('block_hours', STREAM_BLOCK_HOURS))
+        if not 0 < hours_ahead <= MAX_STREAM_HOURS:
+            return jsonify({"error": f"hours_ahead must be between 1 and {MAX_STREAM_HOURS}"}), 400
+        if block_hours < 1:
+            return jsonify({"error": "block_hours must be at least 1"}), 400
+        with time_stage('conditions'):
+            current_conditions = extract_conditions(data)
+    except UnknownStationError as e:
+        return jsonify({"error": str(e)}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    events = forecast_events(forecaster, data, current_conditions, hours_ahead, block_hours,
+                             make_encoder(format_name, app.json.dumps))
+    # Ask proxies not to buffer, so each block reaches the client when it is sent
+    return Response(events, mimetype=STREAM_FORMATS[format_name],
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def forecast_events(active, data, current_conditions, hours_ahead, block_hours, encoder):
+    """Encoded records of one streamed forecast: meta, each block of hours with a summary after each day, then end.
+    
+    Only the current day's hours are kept, so memory does not grow with the
+    horizon. An error after the stream started is sent as an error record.
+    """
+    start = time.perf_counter()
+    now = datetime.now()
+    pollutants = [target for target in active.target_columns if target in active.models]
+    meta = {
+        'timestamp': now.isoformat(),
+        'location': data.get('location', data.get('station_id', 'Unknown')),
+        'model_version': active.model_version,
+        'current_conditions': current_conditions,
+        'hours_ahead': hours_ahead,
+        'pollutants': pollutants
+    }
+    if data.get('station_id') is not None:
+        observed_at = feature_store.observed_at(data['station_id'])
+        meta['station_id'] = data['station_id']
+        meta['observed_at'] = observed_at.isoformat() if observed_at else None
+    yield encoder.record('meta', meta)
+    
+    day_values = np.zeros((len(pollutants), 0))
+    day_aqi = np.zeros(0, dtype=int)
+    day = 0
+    try:
+        for first_hour, block in active.iter_forecast_batch([current_conditions], hours_ahead, block_hours=block_hours):
+            values = np.array([block[p][0] for p in pollutants], dtype=float).reshape(len(pollutants), -1)
+            aqi_values, _ = active.calculate_aqi_batch(values, pollutants)
+            if first_hour == 0:
+                registry.observe('airsense_stage_duration_seconds', time.perf_counter() - start,
+                                 stage='stream_first_block')
+            yield encoder.hours(first_hour, now + timedelta(hours=first_hour), pollutants, values, aqi_values,
+                                get_aqi_level(aqi_values))
             
-            if daily_aqi_values:
-                avg_aqi = int(np.mean(daily_aqi_values))
-                max_aqi = int(np.max(daily_aqi_values))
-                
-                forecast_date = datetime.now() + timedelta(days=day)
-                
-                response['daily_summary'].append({
-                    'day': day,
-                    'date': forecast_date.strftime('%Y-%m-%d'),
-                    'day_name': forecast_date.strftime('%A'),
-                    'avg_aqi': avg_aqi,
-                    'max_aqi': max_aqi,
-                    'level': get_aqi_level(avg_aqi),
-                    'dominant_pollutant': get_dominant_pollutant(daily_pollutants),
-                    'recommendation': get_health_recommendation(avg_aqi)
-                })
-        
-        return jsonify(response)
+            # Summarize each day once its last hour has been sent
+            day_values = np.concatenate([day_values, values], axis=1)
+            day_aqi = np.concatenate([day_aqi, aqi_values])
+            while len(day_aqi) >= 24:
+                yield encoder.record('day', summarize_days(day_aqi[:24], day_values[:, :24], pollutants, now, day)[0])
+                day_values, day_aqi, day = day_values[:, 24:], day_aqi[24:], day + 1
+        for summary in summarize_days(day_aqi, day_values, pollutants, now, day):
+            yield encoder.record('day', summary)
+    except Exception as e:
+        yield encoder.record('error', {'error': str(e)})
+        return
+    
+    seconds = time.perf_counter() - start
+    registry.observe('airsense_stage_duration_seconds', seconds, stage='stream')
+    yield encoder.record('end', {'hours': hours_ahead, 'seconds': seconds})
+
+def valid_hours_ahead(hours_ahead):
+    """Whether a requested horizon is an integer from 0 to MAX_FORECAST_HOURS"""
+    return (isinstance(hours_ahead, int) and not isinstance(hours_ahead, bool)
+            and 0 <= hours_ahead <= MAX_FORECAST_HOURS)
+
+def precomputed_forecast(data):
+    """The stored response of a registered location_id, or None to forecast on demand.
+    
+    A stored forecast is used while it comes from the served model version,
+    the request asks for the registered horizon, and it either sends no
+    other fields or the same ones it was registered with; the Age header and
+    computed_at give its staleness.
+    """
+    location_id = data.get('location_id')
+    entry = forecast_scheduler.get(str(location_id)) if location_id is not None else None
+    if entry is None or entry['model_version'] != forecaster.model_version:
+        return None
+    if data.get('hours_ahead', entry['hours_ahead']) != entry['hours_ahead']:
+        return None
+    ignored = ('location_id', 'hours_ahead')
+    inputs = {key: value for key, value in data.items() if key not in ignored}
+    if inputs and inputs != {key: value for key, value in entry['spec'].items() if key not in ignored}:
+        return None
+    age = max(0, int(time.time() - entry['computed_at_ts']))
+    return Response(entry['body'], mimetype='application/json', headers={'Age': str(age)})
+
+def precompute_forecasts(specs):
+    """Forecast registered locations in one batched prediction for the scheduler.
+    
+    Returns the model version and, by location ID, the serialized /forecast
+    response or the error that kept the location from being forecast.
+    """
+    if not model_state['ready']:
+        raise RuntimeError(model_state['error'] or "Models are loading")
+    
+    active = forecaster
+    results = {}
+    conditions = {}
+    for location_id, spec in specs.items():
+        try:
+            conditions[location_id] = extract_conditions(spec)
+        except UnknownStationError as e:
+            results[location_id] = e
+    
+    location_ids = list(conditions)
+    horizons = [specs[location_id].get('hours_ahead', 24) for location_id in location_ids]
+    with time_stage('precompute'):
+        forecasts = active.predict_forecast_batch([conditions[location_id] for location_id in location_ids], horizons)
+        for location_id, hours_ahead, location_forecasts in zip(location_ids, horizons, forecasts):
+            response = build_forecast_response(active, specs[location_id], conditions[location_id], hours_ahead,
+                                               location_forecasts)
+            response.update(location_id=location_id, precomputed=True, computed_at=response['timestamp'])
+            results[location_id] = app.json.dumps(response)
+    return active.model_version, results
+
+def extract_conditions(data):
+    """Extract current conditions from a request, or from the feature store for a station_id"""
+    if data.get('station_id') is not None:
+        return station_conditions(data['station_id'])
+    
+    now = datetime.now()
+    return {
+        'temperature': data.get('temperature', 20),
+        'humidity': data.get('humidity', 60),
+        'wind_speed': data.get('wind_speed', 5),
+        'pressure': data.get('pressure', 1013),
+        'hour': data.get('hour', now.hour),
+        'day_of_week': data.get('day_of_week', now.weekday()),
+        'month': data.get('month', now.month),
+        'season': data.get('season', (now.month - 1) // 3)
+    }
+
+class UnknownStationError(LookupError):
+    """A forecast for a station_id that has no observations"""
+
+def station_conditions(station_id):
+    """Current conditions of a station with lag and rolling features from its recent observations"""
+    features = feature_store.features(station_id)
+    if features is None:
+        raise UnknownStationError(f"No observations for station: {station_id}")
+    
+    # Weather the station never reported falls back to the request defaults
+    conditions = extract_conditions({})
+    conditions.update(features)
+    return conditions
+
+def build_forecast_response(active, data, current_conditions, hours_ahead, forecasts):
+    """Format one location's forecast with hourly AQI and a daily summary"""
+    response = {
+        'timestamp': datetime.now().isoformat(),
+        'location': data.get('location', data.get('station_id', 'Unknown')),
+        'model_version': active.model_version,
+        'current_conditions': current_conditions,
+        'forecasts': {},
+        'hourly_aqi': [],
+        'daily_summary': []
+    }
+    
+    if data.get('station_id') is not None:
+        observed_at = feature_store.observed_at(data['station_id'])
+        response['station_id'] = data['station_id']
+        response['observed_at'] = observed_at.isoformat() if observed_at else None
     
+    # Process forecasts
+    for pollutant, predictions in forecasts.items():
+        response['forecasts'][pollutant] = predictions
+    
+    # Compute AQI once for every hour the hourly list and daily summary need
+    pollutants = list(forecasts)
+    n_hours = max(0, min(hours_ahead, 72))
+    values = np.array([forecasts[p][:n_hours] for p in pollutants], dtype=float).reshape(len(pollutants), n_hours)
+    with time_stage('aqi'):
+        aqi_values, _ = active.calculate_aqi_batch(values, pollutants)
+        levels = get_aqi_level(aqi_values)
+    now = datetime.now()
+    
+    # Calculate hourly AQI
+    for hour in range(min(hours_ahead, 24)):
+        forecast_time = now + timedelta(hours=hour)
+        response['hourly_aqi'].append({
+            'hour': hour,
+            'time': forecast_time.isoformat(),
+            'aqi': int(aqi_values[hour]),
+            'level': levels[hour],
+            'pollutants': {p: float(values[i, hour]) for i, p in enumerate(pollutants)}
+        })
+    
+    # Generate daily summary (next 3 days)
+    response['daily_summary'] = summarize_days(aqi_values, values, pollutants, now)
+    
+    return response
+
+def summarize_days(aqi_values, values, pollutants, now, first_day=0):
+    """Daily AQI summaries of hourly AQI and (pollutants x hours) values from day first_day; the last may be partial"""
+    n_hours = len(aqi_values)
+    if not pollutants or n_hours == 0:
+        return []
+    
+    n_days = -(-n_hours // 24)
+    daily_aqi = np.full(n_days * 24, np.nan)
+    daily_aqi[:n_hours] = aqi_values
+    daily_aqi = daily_aqi.reshape(n_days, 24)
+    avg_aqi = np.nanmean(daily_aqi, axis=1).astype(int)
+    max_aqi = np.nanmax(daily_aqi, axis=1).astype(int)
+    daily_levels = get_aqi_level(avg_aqi)
+    dominant = get_dominant_pollutant(values, pollutants)
+    
+    summaries = []
+    for day in range(n_days):
+        forecast_date = now + timedelta(days=first_day + day)
+        
+        summaries.append({
+            'day': first_day + day,
+            'date': forecast_date.strftime('%Y-%m-%d'),
+            'day_name': forecast_date.strftime('%A'),
+            'avg_aqi': int(avg_aqi[day]),
+            'max_aqi': int(max_aqi[day]),
+            'level': daily_levels[day],
+            'dominant_pollutant': dominant[day],
+            'recommendation': get_health_recommendation(int(avg_aqi[day]))
+        })
+    return summaries
+
+def cached_forecasts(active, conditions, horizons):
+    """Predict forecasts for several locations, reusing cached results for nearly identical conditions"""
+    if not forecast_cache.enabled:
+        return predict_forecasts(active, conditions, horizons)
+    
+    # Predict on the quantized conditions so a cached result never depends on who computed it
+    quantized = [forecast_cache.quantize(location_conditions) for location_conditions in conditions]
+    keys = [forecast_cache.make_key(location_conditions, hours_ahead, active.model_version)
+            for location_conditions, hours_ahead in zip(quantized, horizons)]
+    forecasts = [forecast_cache.get(key) for key in keys]
+    
+    # Compute every miss together in one batched prediction
+    misses = [i for i, location_forecasts in enumerate(forecasts) if location_forecasts is None]
+    if misses:
+        computed = predict_forecasts(active, [quantized[i] for i in misses], [horizons[i] for i in misses])
+        for i, location_forecasts in zip(misses, computed):
+            forecasts[i] = location_forecasts
+            forecast_cache.put(keys[i], location_forecasts)
+    return forecasts
+
+def predict_forecasts(active, conditions, horizons):
+    """Predict forecasts directly, or through the micro-batcher when it is enabled"""
+    if micro_batcher.enabled and len(conditions) <= micro_batcher.max_batch_size:
+        futures = [micro_batcher.submit(active, location_conditions, hours_ahead)
+                   for location_conditions, hours_ahead in zip(conditions, horizons)]
+        return [future.result() for future in futures]
+    return active.predict_forecast_batch(conditions, horizons)
+
+@app.route('/stations/<station_id>/observations', methods=['POST'])
+def ingest_observations(station_id):
+    """Record hourly observations for a station: one observation, or a list under 'observations'"""
+    try:
+        data = request.get_json() or {}
+        observations = data['observations'] if isinstance(data.get('observations'), list) else [data]
+        if not observations:
+            return jsonify({"error": "'observations' must be a non-empty list"}), 400
+        
+        for observation in observations:
+            features = feature_store.ingest(station_id, observation)
+        forecast_scheduler.notify_station(station_id)
+        
+        return jsonify({
+            "station_id": station_id,
+            "ingested": len(observations),
+            "observed_at": feature_store.observed_at(station_id).isoformat(),
+            "features": features
+        })
+    
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/stations/<station_id>', methods=['GET'])
+def station_features(station_id):
+    """Get the current model features of a station"""
+    features = feature_store.features(station_id)
+    if features is None:
+        return jsonify({"error": f"No observations for station: {station_id}"}), 404
+    return jsonify({
+        "station_id": station_id,
+        "observed_at": feature_store.observed_at(station_id).isoformat(),
+        "features": features
+    })
+
+@app.route('/stations/stats', methods=['GET'])
+def feature_store_stats():
+    """Feature store station and observation counters"""
+    return jsonify(feature_store.stats())
+
+@app.route('/locations', methods=['GET'])
+def registered_locations():
+    """Locations registered for precomputed forecasts, with when each was last computed"""
+    return jsonify({"locations": forecast_scheduler.locations(), "stats": forecast_scheduler.stats()})
+
+@app.route('/locations', methods=['POST'])
+def register_locations():
+    """Register locations for precomputed forecasts: one /forecast body with a location_id, or a list under 'locations'"""
+    try:
+        data = request.get_json() or {}
+        specs = data['locations'] if isinstance(data.get('locations'), list) else [data]
+        if not specs:
+            return jsonify({"error": "'locations' must be a non-empty list"}), 400
+        for spec in specs:
+            if not isinstance(spec, dict) or spec.get('location_id') is None:
+                return jsonify({"error": "Every location needs a 'location_id'"}), 400
+            if not valid_hours_ahead(spec.get('hours_ahead', 24)):
+                return jsonify({"error": f"'hours_ahead' must be an integer between 0 and {MAX_FORECAST_HOURS}"}), 400
+        
+        forecast_scheduler.register_many({spec['location_id']: spec for spec in specs})
+        forecast_scheduler.start()
+        return jsonify({"registered": [str(spec['location_id']) for spec in specs]}), 201
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/locations/<location_id>', methods=['DELETE'])
+def unregister_location(location_id):
+    """Stop precomputing a location's forecast"""
+    if not forecast_scheduler.unregister(location_id):
+        return jsonify({"error": f"Location not registered: {location_id}"}), 404
+    return jsonify({"unregistered": location_id})
+
+@app.route('/locations/refresh', methods=['POST'])
+def refresh_locations():
+    """Recompute every registered location now instead of at the top of the hour"""
+    forecast_scheduler.refresh_all()
+    forecast_scheduler.start()
+    return jsonify({"scheduled": forecast_scheduler.stats()['locations']}), 202
+
+@app.route('/batching/stats', methods=['GET'])
+def batching_stats():
+    """Micro-batching queue depth and batch-size distribution"""
+    return jsonify(micro_batcher.stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Forecast cache hit, miss and eviction counters"""
+    return jsonify(forecast_cache.stats())
+
 @app.route('/train', methods=['POST'])
 def retrain_models():
-    """Retrain models with new data"""
+    """Start retraining models with new data as a background job.
+    
+    Training data can be sent inline as JSON ('training_data'), streamed as an
+    NDJSON or CSV request body, or read from a local 'data_path'.
+    """
     try:
-        data = request.get_json()
+        job_id = uuid.uuid4().hex
+        if request.mimetype in UPLOAD_FORMATS:
+            # Options come from the query string; the body is spooled to disk without parsing it
+            try:
+                data = {key: int(value) for key, value in request.args.items()
+                        if key in ('n_workers', 'chunk_size', 'select')}
+            except ValueError:
+                return jsonify({"error": "n_workers, chunk_size and select must be integers"}), 400
+            data['data_path'] = save_upload(job_id, UPLOAD_FORMATS[request.mimetype])
+            data['format'] = UPLOAD_FORMATS[request.mimetype]
+            data['delete_data'] = True
+        else:
+            data = request.get_json() or {}
+            data.pop('delete_data', None)
+            if 'data_path' in data:
+                # Server paths are only read from a configured data directory
+                if not TRAINING_DATA_DIR:
+                    return jsonify({"error": "data_path is disabled; set TRAINING_DATA_DIR to enable it"}), 400
+                data_dir = os.path.realpath(TRAINING_DATA_DIR)
+                if os.path.commonpath([data_dir, os.path.realpath(data['data_path'])]) != data_dir:
+                    return jsonify({"error": f"data_path must be inside {TRAINING_DATA_DIR}"}), 400
+            if data.get('grid') is not None:
+                # Grids are accepted inline only, never as a path on the server
+                if not isinstance(data['grid'], dict):
+                    return jsonify({"error": "grid must be an object of model names to hyperparameter lists"}), 400
+                try:
+                    load_grid(data['grid'])
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+        
+        # Forget the oldest finished jobs
+        finished = [jid for jid, job in training_jobs.items() if job['status'] in ('succeeded', 'failed')]
+        for jid in finished[:max(0, len(training_jobs) - MAX_TRAINING_JOBS + 1)]:
+            del training_jobs[jid]
+        
+        training_jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "submitted_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "model_version": None,
+            "training_stats": None,
+            "error": None
+        }
+        update_training_job(job_id)
+        training_executor.submit(run_training_job, job_id, data)
         
-        # Generate new training data or use provided data
+        return jsonify({
+            "status": "queued",
+            "job_id": job_id,
+            "status_url": f"/train/{job_id}",
+            "timestamp": datetime.now().isoformat()
+        }), 202
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/train/<job_id>', methods=['GET'])
+def training_status(job_id):
+    """Get the status of a training job"""
+    job = training_jobs.get(job_id)
+    
+    # Jobs started by another worker process are only visible through their status file
+    job_path = f'{MODEL_DIR}/jobs/{job_id}.json'
+    if job is None and all(c in '0123456789abcdef' for c in job_id) and os.path.exists(job_path):
+        with open(job_path) as f:
+            job = json.load(f)
+    
+    if job is None:
+        return jsonify({"error": f"Unknown training job: {job_id}"}), 404
+    return jsonify(job)
+
+def save_upload(job_id, file_format):
+    """Copy a streamed request body to MODEL_DIR/uploads in fixed-size blocks"""
+    os.makedirs(f'{MODEL_DIR}/uploads', exist_ok=True)
+    path = f'{MODEL_DIR}/uploads/{job_id}.{file_format}'
+    with open(path, 'wb') as f:
+        while True:
+            block = request.stream.read(1 << 20)
+            if not block:
+                break
+            f.write(block)
+    return path
+
+def update_training_job(job_id, **changes):
+    """Update a training job and publish its status for other worker processes"""
+    job = training_jobs[job_id]
+    job.update(changes)
+    try:
+        os.makedirs(f'{MODEL_DIR}/jobs', exist_ok=True)
+        tmp_path = f'{MODEL_DIR}/jobs/{job_id}.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, f'{MODEL_DIR}/jobs/{job_id}.json')
+        if job['status'] in ('succeeded', 'failed'):
+            prune_job_files()
+    except OSError as e:
+        print(f"Could not write status of training job {job_id}: {e}")
+
+def prune_job_files():
+    """Keep the status files of the newest MAX_TRAINING_JOBS jobs"""
+    paths = [entry.path for entry in os.scandir(f'{MODEL_DIR}/jobs') if entry.name.endswith('.json')]
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:-MAX_TRAINING_JOBS]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class TrainingJobError(ValueError):
+    """A training job failure whose message is safe to show in the job status"""
+
+def run_training_job(job_id, data):
+    """Train a new model set, save it as a new version and swap it in"""
+    update_training_job(job_id, status="running", started_at=datetime.now().isoformat())
+    try:
+        trainer = AirQualityForecaster()
+        
+        incremental = data.get('mode') == 'incremental'
+        
+        # Generate new training data or use provided data, read in chunks
+        chunk_size = data.get('chunk_size', DEFAULT_CHUNK_SIZE)
         if 'training_data' in data:
             # Use provided training data
             import pandas as pd
-            df = pd.DataFrame(data['training_data'])
+            training_data = pd.DataFrame(data['training_data'])
+        elif 'data_path' in data:
+            training_data = iter_training_chunks(data['data_path'], chunk_size, data.get('format'))
+        elif incremental:
+            raise TrainingJobError("Incremental updates need new samples in training_data or data_path")
         else:
             # Generate synthetic data
             n_samples = data.get('n_samples', 8760)
-            df = forecaster.generate_synthetic_data(n_samples)
+            training_data = trainer.iter_synthetic_data(n_samples, chunk_size=chunk_size)
         
-        # Retrain models
-        forecaster.train_models(df)
-        forecaster.save_models()
+        if incremental:
+            # Update the latest version's estimators with the new samples only
+            import pandas as pd
+            history = pd.DataFrame(data['history']) if data.get('history') else None
+            trainer.load_latest_models(MODEL_DIR, prefer_bundle=False)
+            chunks = [training_data] if isinstance(training_data, pd.DataFrame) else list(training_data)
+            training_data = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+            try:
+                trainer.check_update_data(training_data)
+                if history is not None:
+                    trainer.check_update_data(history, "History rows")
+            except ValueError as e:
+                raise TrainingJobError(str(e)) from e
+            trainer.update_models(training_data, history=history, n_trees=data.get('n_trees', INCREMENTAL_TREES),
+                                  n_workers=data.get('n_workers'))
+        else:
+            # Retrain models
+            trainer.train_models(training_data, n_workers=data.get('n_workers'), direct=data.get('direct', False),
+                                 select=data.get('select', False), grid=data.get('grid'))
+        if not trainer.models:
+            raise TrainingJobError("No models were trained from the provided data")
+        version = trainer.save_model_version(MODEL_DIR, protect={forecaster.model_version})
+        activate_forecaster(trainer)
         
-        return jsonify({
-            "status": "success",
-            "message": "Models retrained successfully",
-            "timestamp": datetime.now().isoformat()
-        })
-    
+        update_training_job(job_id, status="succeeded", model_version=version,
+                            training_stats=trainer.training_stats, finished_at=datetime.now().isoformat())
+        registry.inc('airsense_training_jobs_total', status='succeeded')
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        # Only our own messages reach the job record; others may quote the training data
+        if isinstance(e, TrainingJobError):
+            error = str(e)
+        else:
+            error = f"Training failed ({type(e).__name__}); see the server log"
+        update_training_job(job_id, status="failed", error=error, finished_at=datetime.now().isoformat())
+        registry.inc('airsense_training_jobs_total', status='failed')
+        print(f"Training job {job_id} failed: {e}")
+    finally:
+        if data.get('delete_data') and os.path.exists(data['data_path']):
+            os.remove(data['data_path'])
+
+AQI_LEVEL_EDGES = np.array([50, 100, 150, 200, 300])
+AQI_LEVELS = np.array([
+    "Good",
+    "Moderate",
+    "Unhealthy for Sensitive Groups",
+    "Unhealthy",
+    "Very Unhealthy",
+    "Hazardous"
+], dtype=object)
+
+# Typical ranges used to compare pollutants on a common scale
+DOMINANT_POLLUTANT_NORMS = {'pm25': 35, 'pm10': 50, 'co2': 1000}
 
 def get_aqi_level(aqi):
-    """Get AQI level description"""
-    if aqi <= 50:
-        return "Good"
-    elif aqi <= 100:
-        return "Moderate"
-    elif aqi <= 150:
-        return "Unhealthy for Sensitive Groups"
-    elif aqi <= 200:
-        return "Unhealthy"
-    elif aqi <= 300:
-        return "Very Unhealthy"
-    else:
-        return "Hazardous"
-
-def get_dominant_pollutant(daily_pollutants):
-    """Get the dominant pollutant for the day"""
-    max_pollutant = "pm25"
-    max_avg = 0
-    
-    for pollutant, values in daily_pollutants.items():
-        if values:
-            avg_value = np.mean(values)
-            # Normalize by typical ranges to compare
-            if pollutant == 'pm25' and avg_value / 35 > max_avg:
-                max_avg = avg_value / 35
-                max_pollutant = pollutant
-            elif pollutant == 'pm10' and avg_value / 50 > max_avg:
-                max_avg = avg_value / 50
-                max_pollutant = pollutant
-            elif pollutant == 'co2' and avg_value / 1000 > max_avg:
-                max_avg = avg_value / 1000
-                max_pollutant = pollutant
-    
-    return max_pollutant.upper()
+    """Get AQI level description for a single AQI value or an array of them"""
+    levels = AQI_LEVELS[np.searchsorted(AQI_LEVEL_EDGES, aqi, side='left')]
+    if np.ndim(aqi) == 0:
+        return levels
+    return levels.tolist()
+
+def get_dominant_pollutant(values, pollutants):
+    """Get the dominant pollutant for each day of a (pollutants x hours) array"""
+    n_days = -(-values.shape[1] // 24)
+    dominant = np.full(n_days, "PM25", dtype=object)
+    if not pollutants or n_days == 0:
+        return dominant.tolist()
+    
+    # Daily means per pollutant; the last day may be partial
+    padded = np.full((len(pollutants), n_days * 24), np.nan)
+    padded[:, :values.shape[1]] = values
+    daily_means = np.nanmean(padded.reshape(len(pollutants), n_days, 24), axis=2)
+    
+    # Normalize by typical ranges to compare; other pollutants never dominate
+    norms = np.array([DOMINANT_POLLUTANT_NORMS.get(p, np.inf) for p in pollutants], dtype=float)
+    normalized = daily_means / norms[:, np.newaxis]
+    
+    has_dominant = normalized.max(axis=0) > 0
+    names = np.array([p.upper() for p in pollutants], dtype=object)
+    dominant[has_dominant] = names[normalized.argmax(axis=0)][has_dominant]
+    return dominant.tolist()
 
 def get_health_recommendation(aqi):
     """Get health recommendation based on AQI"""
@@ -218,4 +945,5 @@ def get_health_recommendation(aqi):
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5002))
+    forecast_scheduler.start()
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
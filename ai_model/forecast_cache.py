@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Default quantization step per input; 1 keeps the calendar fields exact
+DEFAULT_QUANTIZATION = {
+    'temperature': 0.5,
+    'humidity': 1.0,
+    'wind_speed': 0.5,
+    'pressure': 1.0,
+    'hour': 1,
+    'day_of_week': 1,
+    'month': 1,
+    'season': 1
+}
+
+def parse_quantization(spec):
+    """Parse 'temperature=0.5,humidity=2' into quantization steps over the defaults"""
+    quantization = dict(DEFAULT_QUANTIZATION)
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, step = item.split('=', 1)
+        quantization[name.strip()] = float(step)
+    return quantization
+
+class ForecastCache:
+    """Bounded LRU cache of forecasts with TTL expiry, keyed on quantized conditions"""
+    
+    def __init__(self, max_size=1024, ttl=900, quantization=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.quantization = dict(quantization or DEFAULT_QUANTIZATION)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    @classmethod
+    def from_env(cls):
+        """Create a cache configured from FORECAST_CACHE_* environment variables"""
+        return cls(
+            max_size=int(os.environ.get('FORECAST_CACHE_SIZE', 1024)),
+            ttl=float(os.environ.get('FORECAST_CACHE_TTL', 900)),
+            quantization=parse_quantization(os.environ.get('FORECAST_CACHE_QUANTIZATION'))
+        )
+    
+    @property
+    def enabled(self):
+        """Whether caching is on; FORECAST_CACHE_SIZE=0 turns it off"""
+        return self.max_size > 0
+    
+    def quantize(self, conditions):
+        """Snap each condition to its quantization step"""
+        quantized = dict(conditions)
+        for name, step in self.quantization.items():
+            value = quantized.get(name)
+            if step and isinstance(value, (int, float)):
+                quantized[name] = round(round(value / step) * step, 6)
+        return quantized
+    
+    def make_key(self, quantized_conditions, hours_ahead, model_version=None):
+        """Build a cache key from already quantized conditions"""
+        return (model_version, hours_ahead) + tuple(sorted(quantized_conditions.items()))
+    
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self):
+        """Drop every entry, e.g. after a new model version is loaded"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+    
+    def stats(self):
+        """Counters for tuning size, TTL and quantization"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'quantization': self.quantization,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
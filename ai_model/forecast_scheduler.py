@@ -0,0 +1,258 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from background_thread import BackgroundThread
+
+class ForecastScheduler:
+    """Registered locations whose forecasts are precomputed in batches and served from memory.
+    
+    Every registered location is recomputed at the top of each hour, and a
+    station-backed location shortly after its station reports new data.
+    compute takes {location_id: spec} and returns (model_version,
+    {location_id: serialized response or exception}). Lookups are one dict
+    read, so a precomputed forecast costs no inference or serialization.
+    With a path, registrations are kept in that JSON file and every process
+    reloads them when it changes, so each one serves the same locations.
+    """
+    
+    def __init__(self, compute, max_locations=1000, debounce_seconds=1.0, enabled=True, path=None):
+        self.compute = compute
+        self.max_locations = max_locations
+        self.debounce = debounce_seconds
+        self.enabled = enabled
+        self.path = path
+        self._file_state = None
+        self._locations = {}
+        self._forecasts = {}
+        self._pending = set()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._worker = BackgroundThread(self._run, 'forecast-scheduler', reset=self._reset_worker)
+        self.refreshes = 0
+        self.refreshed_locations = 0
+        self.failures = 0
+        self.last_refresh_seconds = None
+        self.last_refresh_at = None
+    
+    @classmethod
+    def from_env(cls, compute):
+        """Create a scheduler configured from FORECAST_PRECOMPUTE* environment variables.
+        
+        Registrations are shared through FORECAST_REGISTRY_FILE (default
+        MODEL_DIR/locations.json); set it empty to keep them in each process.
+        """
+        path = os.environ.get('FORECAST_REGISTRY_FILE',
+                              os.path.join(os.environ.get('MODEL_DIR', 'models'), 'locations.json'))
+        return cls(
+            compute,
+            max_locations=int(os.environ.get('FORECAST_PRECOMPUTE_MAX_LOCATIONS', 1000)),
+            debounce_seconds=float(os.environ.get('FORECAST_PRECOMPUTE_DEBOUNCE', 1.0)),
+            enabled=os.environ.get('FORECAST_PRECOMPUTE', '1') != '0',
+            path=path or None
+        )
+    
+    def register(self, location_id, spec):
+        """Register or replace a location; spec is a /forecast request body for it"""
+        self.register_many({location_id: spec})
+    
+    def register_many(self, specs):
+        """Register or replace several locations at once, or none if that exceeds max_locations"""
+        specs = {str(location_id): dict(spec) for location_id, spec in specs.items()}
+        with self._registry() as locations:
+            if len(set(locations) | set(specs)) > self.max_locations:
+                raise ValueError(f"At most {self.max_locations} registered locations")
+            locations.update(specs)
+        self._wake.set()
+    
+    def unregister(self, location_id):
+        """Remove a location and its stored forecast; returns whether it was registered"""
+        with self._registry() as locations:
+            return locations.pop(location_id, None) is not None
+    
+    @contextmanager
+    def _registry(self):
+        """The registered locations by ID to change, held locked; the changes apply when the block exits"""
+        if not self.path:
+            with self._lock:
+                locations = dict(self._locations)
+                yield locations
+                self._apply(locations)
+            return
+        
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            content = f.read()
+            locations = json.loads(content) if content else {}
+            yield locations
+            # Rewritten in place: readers hold a shared lock, so they never see a partial write
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(locations))
+            f.flush()
+            with self._lock:
+                self._apply(locations)
+                self._file_state = self._stat()
+    
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+    
+    def _sync(self):
+        """Reload the registrations if another process changed the shared file"""
+        if not self.path:
+            return
+        state = self._stat()
+        if state == self._file_state:
+            return
+        try:
+            with open(self.path) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                content = f.read()
+                state = self._stat()
+        except FileNotFoundError:
+            content = ''
+        locations = json.loads(content) if content else {}
+        with self._lock:
+            changed = self._apply(locations)
+            self._file_state = state
+        if changed:
+            self._wake.set()
+    
+    def _apply(self, locations):
+        """Replace the registered locations, dropping stored forecasts of removed or changed ones; needs _lock"""
+        changed = {location_id for location_id in set(locations) | set(self._locations)
+                   if locations.get(location_id) != self._locations.get(location_id)}
+        for location_id in changed:
+            self._forecasts.pop(location_id, None)
+        self._pending = (self._pending | changed) & set(locations)
+        self._locations = locations
+        return changed
+    
+    def locations(self):
+        """Registered locations with the time their stored forecast was computed"""
+        self._sync()
+        with self._lock:
+            return {location_id: dict(spec, computed_at=self._forecasts[location_id]['computed_at']
+                                      if location_id in self._forecasts else None)
+                    for location_id, spec in self._locations.items()}
+    
+    def get(self, location_id):
+        """The stored forecast of a location, or None if it is not registered or not computed yet"""
+        if not self.enabled:
+            return None
+        self._sync()
+        self.start()
+        return self._forecasts.get(location_id)
+    
+    def notify_station(self, station_id):
+        """Recompute the locations backed by a station, e.g. after it reported new observations"""
+        self._sync()
+        with self._lock:
+            ids = {location_id for location_id, spec in self._locations.items()
+                   if spec.get('station_id') is not None and str(spec['station_id']) == str(station_id)}
+            self._pending |= ids
+        if ids:
+            self.start()
+            self._wake.set()
+    
+    def refresh_all(self):
+        """Schedule every registered location for recomputation, e.g. after a model swap"""
+        self._sync()
+        with self._lock:
+            self._pending |= set(self._locations)
+        self._wake.set()
+    
+    def start(self):
+        """Start the refresh thread in this process, if enabled"""
+        if self.enabled:
+            self._worker.ensure_started()
+    
+    def refresh(self, location_ids=None):
+        """Recompute the given locations (default all) in one batch now; returns how many were stored"""
+        with self._lock:
+            ids = set(self._locations) if location_ids is None else set(location_ids) & set(self._locations)
+            specs = {location_id: self._locations[location_id] for location_id in ids}
+        if not specs:
+            return 0
+        
+        start = time.perf_counter()
+        model_version, results = self.compute(specs)
+        computed_at = time.time()
+        stored = 0
+        with self._lock:
+            for location_id, result in results.items():
+                if isinstance(result, Exception) or location_id not in self._locations:
+                    self.failures += isinstance(result, Exception)
+                    continue
+                self._forecasts[location_id] = {
+                    'body': result,
+                    'computed_at': datetime.fromtimestamp(computed_at).isoformat(),
+                    'computed_at_ts': computed_at,
+                    'model_version': model_version,
+                    'spec': specs[location_id],
+                    'hours_ahead': specs[location_id].get('hours_ahead', 24)
+                }
+                stored += 1
+            self.refreshes += 1
+            self.refreshed_locations += stored
+            self.last_refresh_seconds = time.perf_counter() - start
+            self.last_refresh_at = computed_at
+        return stored
+    
+    def _reset_worker(self):
+        # A new refresh thread gets its own wake-up event and recomputes every location it serves
+        self._wake = threading.Event()
+        with self._lock:
+            self._pending = set(self._locations)
+    
+    def _run(self):
+        wake = self._wake
+        while True:
+            # Sleep until the top of the next hour unless new data or registrations arrive first;
+            # a short debounce lets a burst of observations share one batch
+            hourly = False
+            if not self._pending:
+                if wake.wait(3600 - time.time() % 3600):
+                    time.sleep(self.debounce)
+                else:
+                    hourly = True
+            wake.clear()
+            self._sync()
+            with self._lock:
+                ids = set(self._locations) if hourly else self._pending
+                self._pending = set()
+            try:
+                self.refresh(ids)
+            except Exception as e:
+                # Models may still be loading; keep the locations pending until a model swap or a minute passes
+                print(f"Forecast precomputation failed: {e}")
+                with self._lock:
+                    self._pending |= ids
+                wake.wait(60)
+    
+    def stats(self):
+        """Registered and stored locations, and refresh counters"""
+        self._sync()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'locations': len(self._locations),
+                'max_locations': self.max_locations,
+                'stored': len(self._forecasts),
+                'pending': len(self._pending),
+                'refreshes': self.refreshes,
+                'refreshed_locations': self.refreshed_locations,
+                'failures': self.failures,
+                'last_refresh_seconds': self.last_refresh_seconds,
+                'last_refresh_at': datetime.fromtimestamp(self.last_refresh_at).isoformat()
+                if self.last_refresh_at else None
+            }
@@ -0,0 +1,122 @@
+import json
+import struct
+from datetime import timedelta
+import numpy as np
+
+# Streamed forecast formats by name, with their content types
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+    'binary': 'application/vnd.airsense.forecast'
+}
+
+# Binary streams start with BINARY_MAGIC, followed by frames of a one-byte kind,
+# a little-endian uint32 payload length and the payload. Hour frames hold the
+# first hour and hour count (uint32 each), then float32 concentrations with one
+# row per pollutant in the order the meta frame lists them, then uint16 AQI per
+# hour. Every other frame holds a UTF-8 JSON object.
+BINARY_MAGIC = b'AQF1'
+BINARY_KINDS = {'meta': b'M', 'hours': b'H', 'day': b'D', 'end': b'E', 'error': b'X'}
+_FRAME_HEADER = struct.Struct('<cI')
+_HOURS_HEADER = struct.Struct('<II')
+
+def stream_format(name, accept=None):
+    """The stream format asked for by name, or else by an Accept header; NDJSON by default"""
+    if name:
+        if name not in STREAM_FORMATS:
+            raise ValueError(f"Unknown stream format: {name} (expected one of {', '.join(STREAM_FORMATS)})")
+        return name
+    for format_name, mimetype in STREAM_FORMATS.items():
+        if accept and mimetype in accept:
+            return format_name
+    return 'ndjson'
+
+class TextStreamEncoder:
+    """NDJSON lines or server-sent events, one record per forecast hour and per day"""
+    
+    def __init__(self, format_name='ndjson', dumps=json.dumps):
+        self.format_name = format_name
+        self.dumps = dumps
+    
+    def record(self, kind, payload):
+        """One record; NDJSON carries the kind as 'type', SSE as the event name"""
+        if self.format_name == 'sse':
+            return f'event: {kind}\ndata: {self.dumps(payload)}\n\n'
+        return self.dumps({'type': kind, **payload}) + '\n'
+    
+    def hours(self, start, first_time, pollutants, values, aqi, levels):
+        """Records for a block of hours from start, the first at first_time; values is (pollutants x hours)"""
+        columns = values.T.tolist()
+        return ''.join(self.record('hour', {
+            'hour': start + j,
+            'time': (first_time + timedelta(hours=j)).isoformat(),
+            'aqi': int(aqi[j]),
+            'level': levels[j],
+            'pollutants': dict(zip(pollutants, column))
+        }) for j, column in enumerate(columns))
+
+class BinaryStreamEncoder:
+    """Compact columnar frames: a block of hours costs 4 bytes per pollutant and 2 for AQI per hour"""
+    
+    format_name = 'binary'
+    
+    def __init__(self, dumps=json.dumps):
+        self.dumps = dumps
+        self.started = False
+    
+    def record(self, kind, payload):
+        """One frame with a JSON or raw payload; the stream's first frame is preceded by BINARY_MAGIC"""
+        if isinstance(payload, dict):
+            payload = self.dumps(payload).encode()
+        header = _FRAME_HEADER.pack(BINARY_KINDS[kind], len(payload))
+        if not self.started:
+            self.started = True
+            header = BINARY_MAGIC + header
+        return header + payload
+    
+    def hours(self, start, first_time, pollutants, values, aqi, levels):
+        """A block of hours; times and levels follow from the meta frame's timestamp and the AQI"""
+        return self.record('hours', _HOURS_HEADER.pack(start, values.shape[1])
+                           + np.ascontiguousarray(values, dtype='<f4').tobytes()
+                           + np.asarray(aqi, dtype='<u2').tobytes())
+
+def make_encoder(format_name, dumps=json.dumps):
+    """An encoder for one streamed response in the given format"""
+    if format_name == 'binary':
+        return BinaryStreamEncoder(dumps)
+    return TextStreamEncoder(format_name, dumps)
+
+def decode_binary_stream(data):
+    """Decode a binary forecast stream into (kind, payload) pairs.
+    
+    Hour frames decode to {'start', 'values' ((pollutants x hours) float32
+    array), 'aqi'}; the pollutant order is the meta frame's 'pollutants'.
+    """
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError("Not an AirSense binary forecast stream")
+    kinds = {code: kind for kind, code in BINARY_KINDS.items()}
+    n_pollutants = 0
+    offset = len(BINARY_MAGIC)
+    frames = []
+    while offset < len(data):
+        code, length = _FRAME_HEADER.unpack_from(data, offset)
+        offset += _FRAME_HEADER.size
+        payload = data[offset:offset + length]
+        offset += length
+        kind = kinds[code]
+        if kind != 'hours':
+            payload = json.loads(payload)
+            if kind == 'meta':
+                n_pollutants = len(payload['pollutants'])
+            frames.append((kind, payload))
+            continue
+        
+        start, n_hours = _HOURS_HEADER.unpack_from(payload)
+        values_end = _HOURS_HEADER.size + 4 * n_pollutants * n_hours
+        frames.append((kind, {
+            'start': start,
+            'values': np.frombuffer(payload[_HOURS_HEADER.size:values_end], dtype='<f4')
+            .reshape(n_pollutants, n_hours),
+            'aqi': np.frombuffer(payload[values_end:], dtype='<u2')
+        }))
+    return frames
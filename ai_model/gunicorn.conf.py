@@ -0,0 +1,28 @@
+import gc
+import multiprocessing
+import os
+
+# Production entry point: gunicorn -c gunicorn.conf.py forecast_api:app
+bind = f"0.0.0.0:{os.environ.get('PORT', 5002)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Import the app, and so load the models, once in the master before forking.
+# Workers then share the read-only estimator memory copy-on-write.
+preload_app = True
+
+def pre_fork(server, worker):
+    # Keep the garbage collector from writing to the shared preloaded objects
+    gc.freeze()
+
+def post_fork(server, worker):
+    # After a graceful reload (SIGHUP) new workers start from the master's
+    # preloaded models, so pick up any newer published version right away
+    import forecast_api
+    forecast_api.refresh_models()
+    # Threads do not survive the fork: precompute registered locations in each worker
+    forecast_api.forecast_scheduler.start()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import time
+import numpy as np
+from air_quality_forecaster import AirQualityForecaster
+
+def horizon_mae(forecaster, conditions, actual, method):
+    """MAE per forecast hour and target of one method against the actual values (targets x starts x hours)"""
+    hours_ahead = actual.shape[2]
+    forecasts = forecaster.predict_forecast_batch(conditions, hours_ahead, method=method)
+    targets = [target for target in forecaster.target_columns if target in forecasts[0]]
+    predicted = np.array([[forecast[target] for forecast in forecasts] for target in targets])
+    return {target: np.mean(np.abs(predicted[i] - actual[forecaster.target_columns.index(target)]), axis=0)
+            for i, target in enumerate(targets)}
+
+def time_batch(forecaster, conditions, hours_ahead, method, repeats=5):
+    """Best wall time in milliseconds of one batched forecast call"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        forecaster.predict_forecast_batch(conditions, hours_ahead, method=method)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def compare_methods(train_hours=2000, eval_hours=500, n_starts=50, hours_ahead=72,
+                    latency_horizons=(24, 72, 168), batch_size=64, seed=42):
+    """Compare recursive and direct multi-horizon forecasts on held-out synthetic data.
+    
+    Trains both model sets on train_hours, then forecasts hours_ahead hours
+    from n_starts start times in the eval_hours that follow and scores every
+    forecast hour against what actually happened. Latency is measured for one
+    location and for a batch at each of latency_horizons.
+    """
+    forecaster = AirQualityForecaster()
+    df = forecaster.generate_synthetic_data(train_hours + eval_hours, seed=seed)
+    forecaster.train_models(df.iloc[:train_hours].copy(), n_workers=1, direct=True)
+    forecaster.compile_models()
+    
+    features = forecaster.prepare_features(df.copy())
+    feature_cols = forecaster.get_model_features()
+    rows = features[feature_cols].ffill().fillna(0)
+    starts = np.linspace(train_hours, len(df) - hours_ahead, n_starts).astype(int)
+    conditions = [rows.iloc[start].to_dict() for start in starts]
+    actual = np.array([[features[target].ffill().to_numpy()[start:start + hours_ahead] for start in starts]
+                       for target in forecaster.target_columns])
+    
+    mae = {method: horizon_mae(forecaster, conditions, actual, method) for method in ('recursive', 'direct')}
+    checkpoints = [hour for hour in (1, 3, 6, 12, 24, 48, 72) if hour < hours_ahead]
+    
+    latency = {}
+    for method in ('recursive', 'direct'):
+        latency[method] = {}
+        for hours in latency_horizons:
+            latency[method][f'single_{hours}h_ms'] = time_batch(forecaster, conditions[:1], hours, method)
+            latency[method][f'batch{batch_size}_{hours}h_ms'] = time_batch(
+                forecaster, (conditions * (batch_size // len(conditions) + 1))[:batch_size], hours, method)
+    
+    return {
+        'train_hours': train_hours,
+        'eval_starts': len(starts),
+        'horizons': list(forecaster.direct_horizons),
+        'mae': {method: {target: {str(hour): float(errors[hour]) for hour in checkpoints}
+                         for target, errors in per_target.items()}
+                for method, per_target in mae.items()},
+        'mean_mae': {method: {target: float(errors.mean()) for target, errors in per_target.items()}
+                     for method, per_target in mae.items()},
+        'latency_ms': latency
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare recursive and direct multi-horizon forecasts")
+    parser.add_argument('--train-hours', type=int, default=2000)
+    parser.add_argument('--eval-hours', type=int, default=500)
+    parser.add_argument('--starts', type=int, default=50, help="Forecast start times scored")
+    parser.add_argument('--hours-ahead', type=int, default=72, help="Hours scored from each start")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--json', action='store_true', help="Print the raw results as JSON")
+    args = parser.parse_args()
+    
+    results = compare_methods(args.train_hours, args.eval_hours, args.starts, args.hours_ahead,
+                              batch_size=args.batch_size)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"\nMAE by forecast hour ({results['eval_starts']} start times)")
+        for target in results['mean_mae']['recursive']:
+            hours = list(results['mae']['recursive'][target])
+            print(f"{target:<8} {'hour':>9} " + ' '.join(f"{hour:>7}" for hour in hours) + f" {'mean':>7}")
+            for method in ('recursive', 'direct'):
+                errors = results['mae'][method][target]
+                print(f"{'':<8} {method:>9} " + ' '.join(f"{errors[hour]:>7.2f}" for hour in hours)
+                      + f" {results['mean_mae'][method][target]:>7.2f}")
+        print("\nLatency (ms)")
+        for method, timings in results['latency_ms'].items():
+            print(f"{method:>9}: " + ', '.join(f"{name[:-3]} {ms:.2f}" for name, ms in timings.items()))
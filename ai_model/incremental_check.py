@@ -0,0 +1,123 @@
+import argparse
+import copy
+import json
+import time
+import numpy as np
+from air_quality_forecaster import AirQualityForecaster, FEATURE_HISTORY_HOURS, INCREMENTAL_TREES
+
+def holdout_mae(forecaster, df, eval_rows):
+    """One-step-ahead MAE per target on the given rows of a feature-prepared DataFrame"""
+    import pandas as pd
+    
+    feature_cols = forecaster.get_model_features()
+    X = df[feature_cols].ffill().fillna(0).iloc[eval_rows]
+    errors = {}
+    for target, model in forecaster.models.items():
+        X_scaled = forecaster.scalers[target].transform(pd.DataFrame(X.to_numpy(dtype=np.float32), columns=feature_cols))
+        errors[target] = float(np.mean(np.abs(model.predict(X_scaled) - df[target].iloc[eval_rows].to_numpy())))
+    return errors
+
+def existing_tree_predictions(model, n_trees, X):
+    """Predictions of only the first n_trees trees (forests) or stages (boosting) of a model"""
+    if type(model).__name__ == 'RandomForestRegressor':
+        return np.mean([estimator.predict(X) for estimator in model.estimators_[:n_trees]], axis=0)
+    for n, predictions in enumerate(model.staged_predict(X), 1):
+        if n == n_trees:
+            return predictions
+
+def unchanged_existing_trees(base, updated, n_trees, X):
+    """Whether the trees an update kept predict exactly as before on the rows X, per target.
+    
+    Forests drop their oldest trees past INCREMENTAL_MAX_TREES, so the kept
+    trees are compared with the newest trees of the base forest.
+    """
+    import pandas as pd
+    
+    unchanged = {}
+    for target, model in base.models.items():
+        X_scaled = base.scalers[target].transform(pd.DataFrame(X, columns=base.get_model_features()))
+        X_updated = updated.scalers[target].transform(pd.DataFrame(X, columns=updated.get_model_features()))
+        new_model = updated.models[target]
+        if type(model).__name__ == 'RandomForestRegressor':
+            kept = len(new_model.estimators_) - n_trees
+            before = np.mean([estimator.predict(X_scaled) for estimator in model.estimators_[-kept:]], axis=0)
+        else:
+            kept = len(model.estimators_) if hasattr(model, 'estimators_') else model.n_iter_
+            before = model.predict(X_scaled)
+        unchanged[target] = bool(np.array_equal(before, existing_tree_predictions(new_model, kept, X_updated)))
+    for target, model in base.direct_models.items():
+        X_scaled = base.scalers[target].transform(pd.DataFrame(X, columns=base.get_model_features()))
+        X_updated = updated.scalers[target].transform(pd.DataFrame(X, columns=updated.get_model_features()))
+        unchanged[target + '_direct'] = bool(np.array_equal(model.predict(X_scaled),
+                                                            updated.direct_models[target].predict(X_updated)))
+    return unchanged
+
+def compare_update(history_hours=4380, new_hours=168, eval_hours=168, n_trees=INCREMENTAL_TREES, seed=42, direct=False):
+    """Compare an incremental update with a full retrain on the same new data.
+    
+    Trains a base model on history_hours of synthetic data, then brings it up
+    to date with the next new_hours either incrementally or by retraining on
+    everything. Both are scored on the eval_hours that follow, and the trees
+    the update kept are checked to predict the history rows as before.
+    """
+    base = AirQualityForecaster()
+    df = base.generate_synthetic_data(history_hours + new_hours + eval_hours, seed=seed)
+    history = df.iloc[:history_hours]
+    new = df.iloc[history_hours:history_hours + new_hours]
+    
+    start = time.process_time()
+    base.train_models(history.copy(), n_workers=1, direct=direct)
+    base_cpu = time.process_time() - start
+    
+    incremental = copy.deepcopy(base)
+    start = time.process_time()
+    incremental.update_models(new.copy(), history=history.iloc[-FEATURE_HISTORY_HOURS:].copy(), n_trees=n_trees, n_workers=1)
+    incremental_cpu = time.process_time() - start
+    
+    full = AirQualityForecaster()
+    start = time.process_time()
+    full.train_models(df.iloc[:history_hours + new_hours].copy(), n_workers=1)
+    full_cpu = time.process_time() - start
+    
+    features = base.prepare_features(df.copy())
+    eval_rows = np.arange(history_hours + new_hours, len(df))
+    history_X = features[base.get_model_features()].ffill().fillna(0).iloc[:history_hours].to_numpy(dtype=np.float32)
+    unchanged = unchanged_existing_trees(base, incremental, n_trees, history_X)
+    mae = {name: holdout_mae(forecaster, features, eval_rows)
+           for name, forecaster in (('base', base), ('incremental', incremental), ('full', full))}
+    
+    return {
+        'history_hours': history_hours,
+        'new_hours': new_hours,
+        'eval_hours': eval_hours,
+        'n_trees': n_trees,
+        'cpu_seconds': {'base': base_cpu, 'incremental': incremental_cpu, 'full': full_cpu},
+        'mae': mae,
+        'unchanged': unchanged,
+        'drift': {target: mae['incremental'][target] - mae['full'][target] for target in mae['full']}
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare incremental model updates with a full retrain")
+    parser.add_argument('--history-hours', type=int, default=4380)
+    parser.add_argument('--new-hours', type=int, default=168)
+    parser.add_argument('--eval-hours', type=int, default=168)
+    parser.add_argument('--trees', type=int, default=INCREMENTAL_TREES)
+    parser.add_argument('--direct', action='store_true', help="Also train direct models and check they are unchanged")
+    parser.add_argument('--json', action='store_true', help="Print the raw results as JSON")
+    args = parser.parse_args()
+    
+    results = compare_update(args.history_hours, args.new_hours, args.eval_hours, args.trees, direct=args.direct)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        cpu = results['cpu_seconds']
+        print(f"\nCPU: incremental {cpu['incremental']:.2f}s, full retrain {cpu['full']:.2f}s "
+              f"({cpu['incremental'] / cpu['full']:.1%})")
+        print(f"{'target':<8} {'base MAE':>9} {'incr MAE':>9} {'full MAE':>9} {'drift':>7}")
+        for target, drift in results['drift'].items():
+            print(f"{target:<8} {results['mae']['base'][target]:>9.2f} {results['mae']['incremental'][target]:>9.2f} "
+                  f"{results['mae']['full'][target]:>9.2f} {drift:>+7.2f}")
+        changed = [target for target, same in results['unchanged'].items() if not same]
+        print("Existing trees: " + (f"predictions changed for {', '.join(changed)}" if changed
+                                    else "predictions on the history rows unchanged"))
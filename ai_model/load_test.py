@@ -0,0 +1,68 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+import numpy as np
+
+def run_load(url, concurrency=16, requests_per_worker=50, hours_ahead=24, seed=0):
+    """Send concurrent /forecast requests and report throughput and latency percentiles"""
+    rng = np.random.default_rng(seed)
+    bodies = [json.dumps({
+        'temperature': float(rng.uniform(0, 35)),
+        'humidity': float(rng.uniform(20, 90)),
+        'wind_speed': float(rng.uniform(0, 15)),
+        'pressure': float(rng.uniform(990, 1030)),
+        'hour': int(rng.integers(0, 24)),
+        'hours_ahead': hours_ahead
+    }).encode() for _ in range(concurrency * requests_per_worker)]
+    
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    
+    def worker(offset):
+        for body in bodies[offset::concurrency]:
+            request = urllib.request.Request(f'{url}/forecast', body, {'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(request).read()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    latencies.sort()
+    
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else None
+    
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(0.5),
+        'p99_ms': percentile(0.99)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test a running forecast API')
+    parser.add_argument('--url', default='http://localhost:5002')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50, help='requests per concurrent client')
+    parser.add_argument('--hours-ahead', type=int, default=24)
+    args = parser.parse_args()
+    
+    print(json.dumps(run_load(args.url, args.concurrency, args.requests, args.hours_ahead), indent=2))
@@ -0,0 +1,123 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   300.0)
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if value not in (float('inf'), float('-inf')) else ('+Inf' if value > 0 else '-Inf')
+
+class MetricsRegistry:
+    """Counters, gauges and latency histograms, rendered in the Prometheus text format.
+    
+    Series are keyed by their label values, passed as keyword arguments.
+    Collectors are called at render time for values kept elsewhere, such as
+    cache counters or model state, so nothing is updated on the hot path.
+    """
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._metrics = {}
+        self._series = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+    
+    def counter(self, name, help_text):
+        """Declare a counter"""
+        self._declare(name, 'counter', help_text)
+    
+    def gauge(self, name, help_text):
+        """Declare a gauge"""
+        self._declare(name, 'gauge', help_text)
+    
+    def histogram(self, name, help_text):
+        """Declare a histogram over the registry's latency buckets"""
+        self._declare(name, 'histogram', help_text)
+    
+    def _declare(self, name, kind, help_text):
+        with self._lock:
+            self._metrics.setdefault(name, (kind, help_text))
+            self._series.setdefault(name, {})
+    
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter series"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            series[key] = series.get(key, 0) + value
+    
+    def set(self, name, value, **labels):
+        """Set a gauge series"""
+        with self._lock:
+            self._series[name][tuple(sorted(labels.items()))] = value
+    
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram series"""
+        key = tuple(sorted(labels.items()))
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series[name]
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+    
+    @contextmanager
+    def time_stage(self, stage):
+        """Time the enclosed block into airsense_stage_duration_seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('airsense_stage_duration_seconds', time.perf_counter() - start, stage=stage)
+    
+    def add_collector(self, collector):
+        """Register a callable returning (counter or gauge name, labels dict, value) tuples read at render time"""
+        self._collectors.append(collector)
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        collected = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                if value is not None:
+                    collected.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+        
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._metrics.items():
+                series = {**self._series[name], **collected.get(name, {})}
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in series.items():
+                    if kind != 'histogram':
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(labels, [("le", _format_value(bound))])} '
+                                     f'{cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+# Process-wide registry shared by the forecaster and the API
+registry = MetricsRegistry()
+registry.histogram('airsense_stage_duration_seconds',
+                   "Time spent in each forecasting, training and model loading stage")
+
+def time_stage(stage):
+    """Time the enclosed block as a stage in the process-wide registry"""
+    return registry.time_stage(stage)
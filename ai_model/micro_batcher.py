@@ -0,0 +1,117 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from background_thread import BackgroundThread
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class MicroBatcher:
+    """Queue concurrent forecast requests briefly and predict them as one batch.
+    
+    A request waits at most max_wait_ms for others to join, or until
+    max_batch_size requests are queued, so added latency stays bounded while
+    the per-call overhead is shared across the batch.
+    """
+    
+    def __init__(self, max_wait_ms=2.0, max_batch_size=64, enabled=True):
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.enabled = enabled
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = BackgroundThread(self._run, 'forecast-batcher', reset=self._reset_queue)
+        self.batches = 0
+        self.requests = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.batch_sizes['+Inf'] = 0
+        self.queue_waits = deque(maxlen=10000)
+    
+    @classmethod
+    def from_env(cls):
+        """Create a batcher configured from FORECAST_MICROBATCH* environment variables"""
+        return cls(
+            max_wait_ms=float(os.environ.get('FORECAST_MICROBATCH_WAIT_MS', 2.0)),
+            max_batch_size=int(os.environ.get('FORECAST_MICROBATCH_MAX_SIZE', 64)),
+            enabled=os.environ.get('FORECAST_MICROBATCH', '0') == '1'
+        )
+    
+    def submit(self, forecaster, conditions, hours_ahead):
+        """Queue one location's forecast; returns a Future with its result"""
+        self._worker.ensure_started()
+        future = Future()
+        self._queue.put((forecaster, conditions, hours_ahead, future, time.perf_counter()))
+        return future
+    
+    def _reset_queue(self):
+        # Requests queued before a fork belong to the parent process
+        with self._lock:
+            self._queue = queue.Queue()
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            self._record(batch)
+            self._predict(batch)
+    
+    def _predict(self, batch):
+        # Requests queued around a model swap keep the forecaster they started with
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item[0]), []).append(item)
+        
+        for items in groups.values():
+            forecaster = items[0][0]
+            try:
+                results = forecaster.predict_forecast_batch([item[1] for item in items], [item[2] for item in items])
+            except Exception as e:
+                for item in items:
+                    item[3].set_exception(e)
+                continue
+            for item, result in zip(items, results):
+                item[3].set_result(result)
+    
+    def _record(self, batch):
+        started = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.max_queue_depth = max(self.max_queue_depth, len(batch) + self._queue.qsize())
+            bucket = next((bucket for bucket in BATCH_SIZE_BUCKETS if len(batch) <= bucket), '+Inf')
+            self.batch_sizes[bucket] += 1
+            self.queue_waits.extend(started - item[4] for item in batch)
+    
+    def stats(self):
+        """Queue depth, batch-size distribution and queueing delay"""
+        with self._lock:
+            waits = sorted(self.queue_waits)
+            
+            def percentile(q):
+                return waits[min(len(waits) - 1, int(q * len(waits)))] * 1000 if waits else 0.0
+            
+            return {
+                'enabled': self.enabled,
+                'max_wait_ms': self.max_wait * 1000,
+                'max_batch_size': self.max_batch_size,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'batches': self.batches,
+                'requests': self.requests,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'batch_size_distribution': {str(bucket): count for bucket, count in self.batch_sizes.items()},
+                'queue_wait_ms': {'p50': percentile(0.5), 'p99': percentile(0.99)}
+            }
@@ -0,0 +1,274 @@
+import json
+import mmap
+import os
+import struct
+import numpy as np
+
+# Bundle layout: magic, format version, header length, JSON header, then raw
+# little-endian arrays, each starting on an ALIGNMENT byte boundary
+BUNDLE_MAGIC = b'AQFB'
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_FILENAME = 'models.bundle'
+DIRECT_BUNDLE_FILENAME = 'direct.bundle'
+ALIGNMENT = 64
+PREAMBLE = struct.Struct('<4sIQ')
+
+class FlatEnsemble:
+    """Tree ensemble flattened into contiguous node arrays.
+    
+    All trees share one set of node arrays; roots holds each tree's first
+    node. Leaves point back to themselves with an infinite threshold, so a
+    fixed number of vectorized steps walks every row to its leaf in every
+    tree. Predictions are offset + scale * (sum of leaf values), which covers
+    both RandomForest averaging and GradientBoosting shrinkage. Multi-output
+    forests keep one leaf value per output, giving (rows x outputs) predictions.
+    """
+    
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+    
+    def __init__(self, feature, threshold, left, right, value, roots, offset=0.0, scale=1.0, depth=0,
+                 model_type=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.offset = offset
+        self.scale = scale
+        self.depth = depth
+        self.model_type = model_type
+    
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted RandomForestRegressor, GradientBoostingRegressor or HistGradientBoostingRegressor"""
+        model_type = type(model).__name__
+        if model_type == 'HistGradientBoostingRegressor':
+            return cls._from_hist_gradient_boosting(model)
+        if model_type == 'RandomForestRegressor':
+            trees = [estimator.tree_ for estimator in model.estimators_]
+            offset, scale = 0.0, 1.0 / len(trees)
+        elif model_type == 'GradientBoostingRegressor':
+            trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+            offset = float(model._raw_predict_init(np.zeros((1, model.n_features_in_)))[0, 0])
+            scale = model.learning_rate
+        else:
+            raise ValueError(f"Unsupported model type: {model_type}")
+        
+        sizes = np.array([tree.node_count for tree in trees])
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+        feature = np.concatenate([tree.feature for tree in trees]).astype(np.int32)
+        threshold = np.concatenate([tree.threshold for tree in trees]).astype(np.float64)
+        left = np.concatenate([tree.children_left + root for tree, root in zip(trees, roots)]).astype(np.int32)
+        right = np.concatenate([tree.children_right + root for tree, root in zip(trees, roots)]).astype(np.int32)
+        value = np.concatenate([tree.value[:, :, 0] for tree in trees]).astype(np.float64)
+        if value.shape[1] == 1:
+            value = value[:, 0]
+        
+        # Make leaves absorbing: any row that reaches one stays there
+        leaves = np.concatenate([tree.children_left == -1 for tree in trees])
+        nodes = np.arange(len(feature), dtype=np.int32)
+        feature[leaves] = 0
+        threshold[leaves] = np.inf
+        left[leaves] = nodes[leaves]
+        right[leaves] = nodes[leaves]
+        
+        depth = max(tree.max_depth for tree in trees)
+        return cls(feature, threshold, left, right, value, roots, offset, scale, depth,
+                   model_type.replace('Regressor', ''))
+    
+    @classmethod
+    def _from_hist_gradient_boosting(cls, model):
+        # Leaf values already include the learning rate; categorical splits are not supported
+        trees = [predictor.nodes for predictors in model._predictors for predictor in predictors]
+        if any(nodes['is_categorical'].any() for nodes in trees):
+            raise ValueError("Categorical splits are not supported")
+        
+        sizes = np.array([len(nodes) for nodes in trees])
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+        feature = np.concatenate([nodes['feature_idx'] for nodes in trees]).astype(np.int32)
+        threshold = np.concatenate([nodes['num_threshold'] for nodes in trees]).astype(np.float64)
+        left = np.concatenate([nodes['left'] + root for nodes, root in zip(trees, roots)]).astype(np.int32)
+        right = np.concatenate([nodes['right'] + root for nodes, root in zip(trees, roots)]).astype(np.int32)
+        value = np.concatenate([nodes['value'] for nodes in trees]).astype(np.float64)
+        
+        # Make leaves absorbing, as for the other ensembles
+        leaves = np.concatenate([nodes['is_leaf'] == 1 for nodes in trees])
+        node_ids = np.arange(len(feature), dtype=np.int32)
+        feature[leaves] = 0
+        threshold[leaves] = np.inf
+        left[leaves] = node_ids[leaves]
+        right[leaves] = node_ids[leaves]
+        
+        depth = max(int(nodes['depth'].max()) for nodes in trees)
+        offset = float(np.ravel(model._baseline_prediction)[0])
+        return cls(feature, threshold, left, right, value, roots, offset, 1.0, depth, 'HistGradientBoosting')
+    
+    def predict(self, X):
+        """Predict for a 2D array of scaled features"""
+        # Trees split on float32 features, as sklearn does; histogram boosting compares float64 inputs
+        X = np.asarray(X, dtype=np.float64 if self.model_type == 'HistGradientBoosting' else np.float32)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        node = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.offset + self.scale * self.value[node].sum(axis=1)
+
+class ScalerParams:
+    """Fitted StandardScaler statistics, enough to scale features for prediction"""
+    
+    def __init__(self, mean, scale, feature_names=None):
+        self.mean_ = mean
+        self.scale_ = scale
+        if feature_names is not None:
+            self.feature_names_in_ = np.array(feature_names, dtype=object)
+    
+    @classmethod
+    def from_sklearn(cls, scaler):
+        """Copy the statistics of a fitted StandardScaler"""
+        n_features = scaler.n_features_in_
+        mean = np.zeros(n_features) if scaler.mean_ is None else np.asarray(scaler.mean_, dtype=np.float64)
+        scale = np.ones(n_features) if scaler.scale_ is None else np.asarray(scaler.scale_, dtype=np.float64)
+        return cls(mean, scale, getattr(scaler, 'feature_names_in_', None))
+    
+    def transform(self, X):
+        """Scale a 2D array of features"""
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+def write_bundle(path, models, scalers, feature_columns, model_version=None, horizons=None):
+    """Write every target's model and scaler into a single bundle file.
+    
+    horizons records the forecast hours predicted by multi-output direct models.
+    """
+    header = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'model_version': model_version,
+        'feature_columns': list(feature_columns),
+        'targets': {}
+    }
+    if horizons is not None:
+        header['horizons'] = [int(hours) for hours in horizons]
+    arrays = []
+    position = 0
+    
+    def add_array(array):
+        nonlocal position
+        array = np.ascontiguousarray(array)
+        arrays.append((position, array))
+        entry = {'offset': position, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        return entry
+    
+    for target, model in models.items():
+        ensemble = model if isinstance(model, FlatEnsemble) else FlatEnsemble.from_sklearn(model)
+        scaler = scalers[target]
+        scaler = scaler if isinstance(scaler, ScalerParams) else ScalerParams.from_sklearn(scaler)
+        header['targets'][target] = {
+            'model_type': ensemble.model_type,
+            'offset': ensemble.offset,
+            'scale': ensemble.scale,
+            'depth': int(ensemble.depth),
+            'arrays': {name: add_array(getattr(ensemble, name)) for name in FlatEnsemble.ARRAYS},
+            'scaler': {'mean': add_array(scaler.mean_), 'scale': add_array(scaler.scale_)}
+        }
+    
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    
+    # Write to a temporary file and rename, so readers never see a partial bundle
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for offset, array in arrays:
+            f.seek(data_start + offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + position)
+    os.replace(tmp_path, path)
+
+def read_bundle(path, use_mmap=True):
+    """Read a bundle file; returns (models, scalers, header).
+    
+    With use_mmap the arrays are read-only views of a shared file mapping, so
+    every process serving the same bundle uses one copy through the page cache.
+    """
+    with open(path, 'rb') as f:
+        magic, format_version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"Not a model bundle: {path}")
+        if format_version > BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported bundle format version: {format_version}")
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = -(-(PREAMBLE.size + header_length) // ALIGNMENT) * ALIGNMENT
+        
+        if use_mmap:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            f.seek(0)
+            buffer = f.read()
+    
+    def get_array(entry):
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + entry['offset'])
+        return array.reshape(entry['shape'])
+    
+    models = {}
+    scalers = {}
+    for target, entry in header['targets'].items():
+        arrays = {name: get_array(spec) for name, spec in entry['arrays'].items()}
+        models[target] = FlatEnsemble(offset=entry['offset'], scale=entry['scale'], depth=entry['depth'],
+                                      model_type=entry['model_type'], **arrays)
+        scalers[target] = ScalerParams(get_array(entry['scaler']['mean']), get_array(entry['scaler']['scale']),
+                                       header['feature_columns'])
+    
+    return models, scalers, header
+
+# Runs in a fresh interpreter to measure one artifact format in isolation
+LOAD_PROBE = '''
+import json, sys, time
+sys.path.insert(0, %r)
+def memory():
+    fields = dict(line.split(':', 1) for line in open('/proc/self/status'))
+    return {key: int(fields[key].split()[0]) / 1024 for key in ('VmRSS', 'RssAnon', 'RssFile')}
+from air_quality_forecaster import AirQualityForecaster
+import numpy as np
+forecaster = AirQualityForecaster()
+before = memory()
+start = time.perf_counter()
+if %r == 'bundle':
+    forecaster.load_bundle(%r)
+else:
+    forecaster.load_models(%r)
+load_seconds = time.perf_counter() - start
+# Touch every tree once so mapped pages count as resident
+X = np.zeros((1, len(forecaster.get_model_features())))
+for model in forecaster.models.values():
+    model.predict(X)
+after = memory()
+print(json.dumps({'load_seconds': load_seconds, **{key: after[key] - before[key] for key in after}}))
+'''
+
+def compare_formats(path):
+    """Compare load time and resident memory of the pickle artifacts and the bundle in path"""
+    import subprocess
+    import sys
+    
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for artifact_format in ('pickle', 'bundle'):
+        probe = LOAD_PROBE % (module_dir, artifact_format, path, path)
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True)
+        results[artifact_format] = json.loads(output.stdout.strip().splitlines()[-1])
+    
+    print(f"{'format':<8} {'load s':>8} {'RSS MB':>8} {'private MB':>11} {'shared MB':>10}")
+    for artifact_format, stats in results.items():
+        print(f"{artifact_format:<8} {stats['load_seconds']:>8.3f} {stats['VmRSS']:>8.1f} "
+              f"{stats['RssAnon']:>11.1f} {stats['RssFile']:>10.1f}")
+    return results
+
+if __name__ == '__main__':
+    import sys
+    
+    compare_formats(sys.argv[1] if len(sys.argv) > 1 else 'models')
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Candidate configurations searched per pollutant by model selection; each
+# params dict overrides build_candidate_model's defaults for that model
+DEFAULT_SEARCH_GRID = {
+    'RandomForest': [
+        {'max_depth': 10},
+        {'max_depth': 15},
+        {'max_depth': None, 'min_samples_leaf': 3}
+    ],
+    'GradientBoosting': [
+        {'max_depth': 3, 'n_estimators': 200},
+        {'max_depth': 6}
+    ],
+    'HistGradientBoosting': [
+        {'learning_rate': 0.1, 'max_leaf_nodes': 31},
+        {'learning_rate': 0.05, 'max_iter': 400, 'max_leaf_nodes': 63}
+    ]
+}
+
+# Rolling-origin folds, and how far behind the best candidate's first-fold MAE
+# (as a fraction) a candidate may be to stay in the search
+SELECTION_FOLDS = int(os.environ.get('SELECTION_FOLDS', 4))
+SELECTION_PRUNE_TOLERANCE = float(os.environ.get('SELECTION_PRUNE_TOLERANCE', 0.15))
+SELECTION_CACHE_DIR = os.environ.get('SELECTION_CACHE_DIR',
+                                     os.path.join(os.environ.get('MODEL_DIR', 'models'), 'selection_cache'))
+
+def load_grid(spec):
+    """Read a search grid from a JSON file path, a JSON string or a dict; None gives DEFAULT_SEARCH_GRID"""
+    if spec is None:
+        return DEFAULT_SEARCH_GRID
+    if isinstance(spec, str):
+        if os.path.exists(spec):
+            with open(spec) as f:
+                spec = json.load(f)
+        else:
+            spec = json.loads(spec)
+    if not isinstance(spec, dict) or not all(isinstance(configs, list) and configs for configs in spec.values()):
+        raise ValueError("A search grid maps model names to non-empty lists of hyperparameter dicts")
+    
+    # Unknown models and hyperparameters fail here rather than in a pool worker
+    from air_quality_forecaster import build_candidate_model
+    for name, configs in spec.items():
+        for params in configs:
+            if not isinstance(params, dict):
+                raise ValueError(f"{name}: hyperparameters must be given as dicts")
+            build_candidate_model(name, params=params)
+    return spec
+
+def candidate_label(name, params):
+    """Readable name of one configuration, e.g. RandomForest(max_depth=10)"""
+    return f"{name}({', '.join(f'{key}={value}' for key, value in sorted(params.items()))})"
+
+def rolling_origin_folds(train_rows, n_folds=SELECTION_FOLDS):
+    """Split chronologically ordered rows into expanding-window (fit rows, validation rows) folds.
+    
+    Each fold fits on everything before its validation block, so no fold
+    ever validates on rows older than the ones it was fitted on.
+    """
+    from sklearn.model_selection import TimeSeriesSplit
+    
+    n_folds = min(n_folds, len(train_rows) - 1)
+    if n_folds < 2:
+        raise ValueError(f"Too few training rows ({len(train_rows)}) for time-series cross-validation")
+    return [(train_rows[fit], train_rows[validate]) for fit, validate in TimeSeriesSplit(n_folds).split(train_rows)]
+
+def data_fingerprint(X, targets, train_rows, grid, n_folds, prune_tolerance):
+    """Hash of the scaled training data and search settings that decide a selection"""
+    import sklearn
+    
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps({'grid': grid, 'folds': n_folds, 'prune_tolerance': prune_tolerance,
+                              'sklearn': sklearn.__version__, 'shape': list(X.shape)},
+                             sort_keys=True).encode())
+    for start in range(0, len(X), 100000):
+        digest.update(np.ascontiguousarray(X[start:start + 100000]).tobytes())
+    for target in sorted(targets):
+        digest.update(target.encode())
+        digest.update(np.ascontiguousarray(targets[target]).tobytes())
+        digest.update(np.ascontiguousarray(train_rows[target]).tobytes())
+    return digest.hexdigest()
+
+def _evaluate_fold(task):
+    """Fit one candidate configuration on one fold and return its validation MAE"""
+    from air_quality_forecaster import _TRAINING_DATA, _fit_limited, build_candidate_model
+    
+    target, candidate, name, params, fold, fit_rows, validate_rows, n_jobs = task
+    X = _TRAINING_DATA['X']
+    y = _TRAINING_DATA['targets'][target]
+    model = build_candidate_model(name, n_jobs, params)
+    _fit_limited(model, X[fit_rows], y[fit_rows], n_jobs)
+    mae = float(np.mean(np.abs(model.predict(X[validate_rows]) - y[validate_rows])))
+    return target, candidate, fold, mae
+
+def select_models(X_path, shape, targets, train_rows, grid=None, n_folds=SELECTION_FOLDS, n_workers=None,
+                  prune_tolerance=SELECTION_PRUNE_TOLERANCE, cache_dir=SELECTION_CACHE_DIR):
+    """Pick a model configuration per target by rolling-origin cross-validation over a grid.
+    
+    X_path is the spooled, scaled float32 feature matrix of the given shape;
+    targets and train_rows map each target to its values and its training
+    rows. Every candidate is scored on the first (smallest, cheapest) fold
+    first; candidates more than prune_tolerance behind the best are dropped,
+    and the survivors' remaining folds run together. The winner has the
+    lowest mean MAE over all folds. Results are cached under cache_dir by a
+    fingerprint of the data and settings, so an unchanged rerun skips the
+    search.
+    """
+    from air_quality_forecaster import _TRAINING_DATA, _init_training_worker
+    
+    grid = load_grid(grid)
+    candidates = [(name, params) for name, configs in grid.items() for params in configs]
+    folds = {target: rolling_origin_folds(train_rows[target], n_folds) for target in targets}
+    
+    X = np.memmap(X_path, dtype=np.float32, mode='r', shape=shape)
+    fingerprint = data_fingerprint(X, targets, train_rows, grid, n_folds, prune_tolerance)
+    del X
+    cache_path = os.path.join(cache_dir, f'{fingerprint}.json') if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            selection = json.load(f)
+        print(f"Model selection: reusing cached results for data fingerprint {fingerprint[:12]}")
+        return dict(selection, cached=True)
+    
+    start = time.perf_counter()
+    scores = {target: {candidate: {} for candidate in range(len(candidates))} for target in targets}
+    n_workers = n_workers or os.cpu_count() or 1
+    
+    def run(pool, tasks):
+        n_jobs = max(1, n_workers // max(1, len(tasks)))
+        tasks = [task + (n_jobs if pool else -1,) for task in tasks]
+        for target, candidate, fold, mae in (pool.map(_evaluate_fold, tasks) if pool
+                                             else map(_evaluate_fold, tasks)):
+            scores[target][candidate][fold] = mae
+    
+    def fold_tasks(target, candidate, fold_ids):
+        name, params = candidates[candidate]
+        return [(target, candidate, name, params, fold) + folds[target][fold] for fold in fold_ids]
+    
+    pool = None
+    if n_workers > 1:
+        pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_training_worker,
+                                   initargs=(X_path, shape, targets))
+    else:
+        _init_training_worker(X_path, shape, targets)
+    try:
+        # Every candidate on the first fold, then the survivors on the rest
+        run(pool, [task for target in targets for candidate in range(len(candidates))
+                   for task in fold_tasks(target, candidate, [0])])
+        survivors = {}
+        for target in targets:
+            best = min(scores[target][candidate][0] for candidate in scores[target])
+            survivors[target] = [candidate for candidate in scores[target]
+                                 if scores[target][candidate][0] <= best * (1 + prune_tolerance)]
+        run(pool, [task for target in targets for candidate in survivors[target]
+                   for task in fold_tasks(target, candidate, range(1, len(folds[target])))])
+    finally:
+        if pool:
+            pool.shutdown()
+        else:
+            _TRAINING_DATA.clear()
+    
+    selection = {'fingerprint': fingerprint, 'folds': n_folds, 'seconds': time.perf_counter() - start, 'targets': {}}
+    for target in targets:
+        results = {}
+        for candidate, fold_maes in scores[target].items():
+            name, params = candidates[candidate]
+            results[candidate_label(name, params)] = {
+                'model': name,
+                'params': params,
+                'fold_mae': [fold_maes[fold] for fold in sorted(fold_maes)],
+                'cv_mae': float(np.mean(list(fold_maes.values()))),
+                'pruned': candidate not in survivors[target]
+            }
+        best_label = min((label for label, result in results.items() if not result['pruned']),
+                         key=lambda label: results[label]['cv_mae'])
+        selection['targets'][target] = {'best': best_label, 'candidates': results}
+        print(f"{target} - Selected {best_label}, CV MAE: {results[best_label]['cv_mae']:.2f} "
+              f"({sum(not result['pruned'] for result in results.values())}/{len(results)} candidates "
+              f"ran all {len(folds[target])} folds)")
+    
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{cache_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(selection, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    return dict(selection, cached=False)
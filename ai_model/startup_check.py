@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+# Budgets in seconds, overridable for slower build machines
+IMPORT_BUDGET = float(os.environ.get('IMPORT_BUDGET_SECONDS', 2.0))
+STARTUP_BUDGET = float(os.environ.get('STARTUP_BUDGET_SECONDS', 10.0))
+
+# Modules the serving path must not import
+FORBIDDEN_MODULES = ['tensorflow', 'keras', 'pandas']
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import forecast_api
+import_seconds = time.perf_counter() - start
+while not forecast_api.model_state['ready'] and not forecast_api.model_state['error']:
+    time.sleep(0.005)
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'startup_seconds': time.perf_counter() - start,
+    'ready': forecast_api.model_state['ready'],
+    'error': forecast_api.model_state['error'],
+    'loaded_modules': [m for m in %r if m in sys.modules]
+}))
+''' % (FORBIDDEN_MODULES,)
+
+def measure_startup():
+    """Measure forecast_api import time and time until models are ready"""
+    env = dict(os.environ, MODEL_LOAD_MODE='background')
+    result = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"forecast_api failed to start:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def check_startup():
+    """Check startup against the budgets and return a list of failures"""
+    stats = measure_startup()
+    print(f"Import: {stats['import_seconds']:.3f}s (budget {IMPORT_BUDGET}s)")
+    print(f"Ready: {stats['startup_seconds']:.3f}s (budget {STARTUP_BUDGET}s)")
+
+    failures = []
+    if stats['import_seconds'] > IMPORT_BUDGET:
+        failures.append(f"import took {stats['import_seconds']:.3f}s")
+    if not stats['ready']:
+        failures.append(f"models not ready: {stats['error']}")
+    elif stats['startup_seconds'] > STARTUP_BUDGET:
+        failures.append(f"startup took {stats['startup_seconds']:.3f}s")
+    if stats['loaded_modules']:
+        failures.append(f"serving imported {', '.join(stats['loaded_modules'])}")
+    return failures
+
+if __name__ == '__main__':
+    failures = check_startup()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,84 @@
+import json
+import os
+import numpy as np
+
+# Rows per chunk when reading training data
+DEFAULT_CHUNK_SIZE = int(os.environ.get('TRAINING_CHUNK_SIZE', 100000))
+
+TRAINING_FORMATS = ('csv', 'parquet', 'ndjson')
+FORMAT_EXTENSIONS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+def detect_format(path):
+    """Guess the training data format of a file from its extension"""
+    file_format = FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Cannot tell the format of {path}; use one of {', '.join(TRAINING_FORMATS)}")
+    return file_format
+
+def compact_dtypes(chunk):
+    """Downcast numeric columns to float32; other columns are left as they are"""
+    numeric = chunk.select_dtypes(include='number').columns
+    return chunk.astype({col: np.float32 for col in numeric})
+
+def iter_training_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, file_format=None):
+    """Yield training data as compact DataFrame chunks of at most chunk_size rows.
+    
+    source is a CSV, Parquet or NDJSON file path, a directory of such files
+    (read in name order, e.g. shards from write_synthetic_data), or a binary
+    stream when file_format is given.
+    """
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        paths = sorted(os.path.join(source, name) for name in os.listdir(source)
+                       if os.path.splitext(name)[1].lower() in FORMAT_EXTENSIONS)
+        if not paths:
+            raise ValueError(f"No training data files in {source}")
+        for path in paths:
+            yield from iter_training_chunks(path, chunk_size, file_format)
+        return
+    
+    if isinstance(source, (str, os.PathLike)):
+        file_format = file_format or detect_format(str(source))
+    if file_format not in TRAINING_FORMATS:
+        raise ValueError(f"Unsupported training data format: {file_format}")
+    
+    if file_format == 'parquet':
+        chunks = _iter_parquet(source, chunk_size)
+    elif file_format == 'csv':
+        chunks = _iter_csv(source, chunk_size)
+    else:
+        chunks = _iter_ndjson(source, chunk_size)
+    
+    for chunk in chunks:
+        yield compact_dtypes(chunk)
+
+def _iter_parquet(source, chunk_size):
+    import pyarrow.parquet as pq
+    
+    for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+def _iter_csv(source, chunk_size):
+    import pandas as pd
+    
+    with pd.read_csv(source, chunksize=chunk_size) as reader:
+        yield from reader
+
+def _iter_ndjson(source, chunk_size):
+    import pandas as pd
+    
+    def read_lines(stream):
+        records = []
+        for line in stream:
+            if line.strip():
+                records.append(json.loads(line))
+            if len(records) == chunk_size:
+                yield pd.DataFrame.from_records(records)
+                records = []
+        if records:
+            yield pd.DataFrame.from_records(records)
+    
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from read_lines(f)
+    else:
+        yield from read_lines(source)